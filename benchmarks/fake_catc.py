@@ -0,0 +1,309 @@
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FAMILIES = ["Switches and Hubs", "Switches and Hubs", "Routers", "Unified AP"]
+PLATFORMS = {
+    "Switches and Hubs": "C9300-48P",
+    "Routers": "ISR4451-X/K9",
+    "Unified AP": "AIR-AP3802I-B-K9",
+}
+
+class SyntheticInventory:
+    def __init__(self, devices=1000, interfaces_per_device=52, floors_per_building=3, devices_per_building=40):
+        """
+        Deterministic synthetic Catalyst Center inventory. Devices and
+        interfaces are generated from their index on demand so large
+        inventories cost no memory up front.
+        """
+        self.device_count = devices
+        self.interfaces_per_device = interfaces_per_device
+        self.buildings = max(1, devices // devices_per_building)
+        self.floors_per_building = floors_per_building
+        self.sites = [{"id": "site-global", "name": "Global", "siteNameHierarchy": "Global"}]
+        self.sites.append({"id": "site-area", "name": "Campus", "siteNameHierarchy": "Global/Campus"})
+        self._floor_sites = []
+        for building in range(self.buildings):
+            hierarchy = f"Global/Campus/Building {building}"
+            self.sites.append({"id": f"site-b{building}", "name": f"Building {building}", "siteNameHierarchy": hierarchy})
+            for floor in range(floors_per_building):
+                site = {
+                    "id": f"site-b{building}-f{floor}",
+                    "name": f"Floor {floor}",
+                    "siteNameHierarchy": f"{hierarchy}/Floor {floor}",
+                }
+                self.sites.append(site)
+                self._floor_sites.append(site["id"])
+        self._site_members = {}
+        for index in range(devices):
+            self._site_members.setdefault(self.device_site(index), []).append(index)
+
+    def device_site(self, index):
+        return self._floor_sites[index % len(self._floor_sites)]
+
+    def device(self, index):
+        family = FAMILIES[index % len(FAMILIES)]
+        building = (index % len(self._floor_sites)) // self.floors_per_building
+        return {
+            "id": f"device-{index}",
+            "instanceUuid": f"device-{index}",
+            "hostname": f"bldg{building}-{'ap3802i' if family == 'Unified AP' else 'c9300'}-{index}.example.edu",
+            "family": family,
+            "role": "ACCESS",
+            "platformId": PLATFORMS[family],
+            "serialNumber": f"FOC{index:08d}",
+            "softwareType": "IOS-XE",
+            "softwareVersion": "17.9.4",
+            "reachabilityStatus": "Reachable",
+            "macAddress": f"00:11:22:{index >> 16 & 255:02x}:{index >> 8 & 255:02x}:{index & 255:02x}",
+            "apEthernetMacAddress": f"00:aa:22:{index >> 16 & 255:02x}:{index >> 8 & 255:02x}:{index & 255:02x}",
+            "managementIpAddress": f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}",
+            "lastUpdateTime": 1700000000000 + index,
+            "interfaceCount": "0" if family == "Unified AP" else str(self.interfaces_per_device),
+        }
+
+    def has_interfaces(self, index):
+        return FAMILIES[index % len(FAMILIES)] != "Unified AP"
+
+    def interface(self, device_index, port):
+        vlan = port >= self.interfaces_per_device - 4
+        return {
+            "id": f"if-{device_index}-{port}",
+            "deviceId": f"device-{device_index}",
+            "portName": f"Vlan{100 + port}" if vlan else f"GigabitEthernet1/0/{port + 1}",
+            "macAddress": f"00:22:33:{device_index >> 8 & 255:02x}:{device_index & 255:02x}:{port:02x}",
+            "description": f"Synthetic port {port} of device {device_index}",
+            "speed": "1000000",
+            "status": "up" if port % 3 else "down",
+            "mtu": "1500",
+            "ipv4Address": f"172.{16 + (device_index >> 16 & 15)}.{device_index >> 8 & 255}.{port}" if vlan else None,
+            "ipv4Mask": "255.255.255.0" if vlan else None,
+        }
+
+    def interfaces(self, device_index):
+        if not self.has_interfaces(device_index):
+            return []
+        return [self.interface(device_index, port) for port in range(self.interfaces_per_device)]
+
+    def interface_devices(self):
+        return [index for index in range(self.device_count) if self.has_interfaces(index)]
+
+    def links(self):
+        """
+        Physical links: each switch's first uplink to the previous switch's
+        last access port, plus an unmanaged neighbour every tenth switch.
+        Reported once from each end, as Catalyst Center does.
+        """
+        switches = self.interface_devices()
+        last_port = f"GigabitEthernet1/0/{max(1, self.interfaces_per_device - 4)}"
+        links = []
+        for previous, index in zip(switches, switches[1:]):
+            for source, source_port, target, target_port in (
+                (f"device-{index}", "GigabitEthernet1/0/1", f"device-{previous}", last_port),
+                (f"device-{previous}", last_port, f"device-{index}", "GigabitEthernet1/0/1"),
+            ):
+                links.append({
+                    "id": f"link-{len(links)}", "source": source, "startPortName": source_port,
+                    "target": target, "endPortName": target_port, "linkStatus": "up",
+                })
+        for index in switches[::10]:
+            links.append({
+                "id": f"link-{len(links)}", "source": f"device-{index}", "startPortName": "GigabitEthernet1/0/2",
+                "target": f"unmanaged-{index}", "endPortName": "Gi0/1", "linkStatus": "up",
+            })
+        return links
+
+    def members(self, site_id):
+        return self._site_members.get(site_id, [])
+
+
+def _matches(device, filters):
+    for key, values in filters.items():
+        if key == "id":
+            if device["id"] not in ",".join(values).split(","):
+                return False
+        elif key == "hostname":
+            if not any(re.fullmatch(value, device["hostname"]) for value in values):
+                return False
+        elif device[key] not in values:
+            return False
+    return True
+
+
+class FakeCatalystCenter:
+    def __init__(self, inventory, latency=0.0, host="127.0.0.1", port=0):
+        """
+        Local stand-in for the Catalyst Center REST API endpoints the agent
+        uses, serving inventory with latency seconds added to every request.
+        Request counts per endpoint are served as JSON from /_stats.
+        """
+        self.inventory = inventory
+        self.latency = latency
+        self.calls = {}
+        self.extra_stats = None
+        self._lock = threading.Lock()
+        self._bulk_interface_devices = None
+        # Event webhook destinations and subscriptions created by the agent
+        self.webhooks = []
+        self.subscriptions = []
+        handler = self._make_handler()
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            stats = {"catc_calls": dict(self.calls), "catc_total_calls": sum(self.calls.values())}
+        if self.extra_stats is not None:
+            stats.update(self.extra_stats())
+        return stats
+
+    def _route(self, method, path, query, request=None):
+        inventory = self.inventory
+        offset = int(query.get("offset", ["1"])[0])
+        limit = int(query.get("limit", ["500"])[0])
+
+        if method == "POST" and path == "/dna/system/api/v1/auth/token":
+            return "auth", {"Token": "fake-token"}
+        if path == "/dna/intent/api/v1/network-device/count":
+            return "device_count", {"response": inventory.device_count, "version": "1.0"}
+        if path == "/dna/intent/api/v1/network-device":
+            filters = {key: query[key] for key in ("family", "role", "hostname", "id", "managementIpAddress") if key in query}
+            if filters:
+                devices = [device for device in map(inventory.device, range(inventory.device_count)) if _matches(device, filters)]
+                return "device_list", {"response": devices[offset - 1:offset - 1 + limit], "version": "1.0"}
+            end = min(inventory.device_count, offset - 1 + limit)
+            return "device_list", {"response": [inventory.device(i) for i in range(offset - 1, end)], "version": "1.0"}
+        match = re.match(r"^/dna/intent/api/v1/network-device/(device-\d+)$", path)
+        if match:
+            return "device_by_id", {"response": inventory.device(int(match.group(1).split("-")[1])), "version": "1.0"}
+        if path == "/dna/intent/api/v1/site/count":
+            return "site_count", {"response": len(inventory.sites), "version": "1.0"}
+        if path == "/dna/intent/api/v1/site":
+            if "name" in query or "siteId" in query:
+                sites = [
+                    site for site in inventory.sites
+                    if site["siteNameHierarchy"] in query.get("name", []) or site["id"] in query.get("siteId", [])
+                ]
+                return "site_by_name", {"response": sites, "version": "1.0"}
+            return "site_list", {"response": inventory.sites[offset - 1:offset - 1 + limit], "version": "1.0"}
+        match = re.match(r"^/dna/intent/api/v1/membership/(.+)$", path)
+        if match:
+            # Devices of the site and all of its children, grouped by site and
+            # paged across the groups
+            site = next((site for site in inventory.sites if site["id"] == match.group(1)), None)
+            subtree = [
+                child for child in inventory.sites
+                if site and (child is site or child["siteNameHierarchy"].startswith(site["siteNameHierarchy"] + "/"))
+            ]
+            family = query.get("deviceFamily", [None])[0]
+            rows = [
+                (child["id"], inventory.device(i)) for child in subtree for i in inventory.members(child["id"])
+                if family is None or inventory.device(i)["family"] == family
+            ][offset - 1:offset - 1 + limit]
+            groups = {}
+            for site_id, device in rows:
+                groups.setdefault(site_id, []).append(device)
+            return "membership", {
+                "site": {"response": [child for child in subtree if child is not site], "version": "1.0"},
+                "device": [{"response": devices, "version": "1.0", "siteId": site_id} for site_id, devices in groups.items()],
+            }
+        if path == "/dna/intent/api/v1/device-detail":
+            index = int(query.get("searchBy", ["device-0"])[0].split("-")[1])
+            site_id = inventory.device_site(index)
+            hierarchy = next(site["siteNameHierarchy"] for site in inventory.sites if site["id"] == site_id)
+            return "device_detail", {"response": {"location": hierarchy}, "version": "1.0"}
+        match = re.match(r"^/dna/intent/api/v1/interface/network-device/device-(\d+)$", path)
+        if match:
+            return "interfaces_by_device", {"response": inventory.interfaces(int(match.group(1))), "version": "1.0"}
+        if path == "/dna/intent/api/v1/interface/count":
+            return "interface_count", {
+                "response": len(self._interface_devices()) * inventory.interfaces_per_device, "version": "1.0"
+            }
+        if path == "/dna/intent/api/v1/interface":
+            devices = self._interface_devices()
+            per_device = inventory.interfaces_per_device
+            end = min(len(devices) * per_device, offset - 1 + limit)
+            rows = [inventory.interface(devices[i // per_device], i % per_device) for i in range(offset - 1, end)]
+            return "interface_list", {"response": rows, "version": "1.0"}
+        if path == "/dna/intent/api/v1/topology/physical-topology":
+            return "physical_topology", {"response": {"nodes": [], "links": inventory.links()}, "version": "1.0"}
+        if path == "/dna/intent/api/v1/event/webhook":
+            if method == "POST":
+                with self._lock:
+                    destination = dict(request, webhookId=f"webhook-{len(self.webhooks)}")
+                    self.webhooks.append(destination)
+                return "webhook_create", {"statusMessage": "created"}
+            return "webhook_list", {"statusMessage": list(self.webhooks)}
+        if path == "/dna/intent/api/v1/event/subscription/rest":
+            if method == "POST":
+                with self._lock:
+                    self.subscriptions.extend(request)
+                return "subscription_create", {"statusUri": "/task/fake"}
+            return "subscription_list", [s for s in self.subscriptions if s["name"] in query.get("name", [s["name"]])]
+        if path == "/_stats":
+            return None, self.stats()
+        return None, None
+
+    def _interface_devices(self):
+        with self._lock:
+            if self._bulk_interface_devices is None:
+                self._bulk_interface_devices = self.inventory.interface_devices()
+            return self._bulk_interface_devices
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                # Only the event endpoints look at the request body
+                request = json.loads(raw) if raw and url.path.startswith("/dna/intent/api/v1/event/") else None
+                endpoint, body = fake._route(method, url.path, parse_qs(url.query), request)
+                if endpoint:
+                    fake._count(endpoint)
+                    if fake.latency:
+                        time.sleep(fake.latency)
+                payload = json.dumps(body if body is not None else {"error": "not found"}).encode()
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
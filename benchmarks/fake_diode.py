@@ -0,0 +1,62 @@
+import time
+import threading
+from concurrent import futures
+
+import grpc
+from netboxlabs.diode.sdk.diode.v1 import ingester_pb2, ingester_pb2_grpc
+
+class FakeDiodeServicer(ingester_pb2_grpc.IngesterServiceServicer):
+    def __init__(self, latency=0.0):
+        """
+        Accepts every Ingest request after latency seconds and records
+        request, entity and byte counts.
+        """
+        self.latency = latency
+        self.requests = 0
+        self.entities = 0
+        self.bytes = 0
+        self.entity_types = {}
+        self.first_request = None
+        self.last_request = None
+        self._lock = threading.Lock()
+
+    def Ingest(self, request, context):
+        if self.latency:
+            time.sleep(self.latency)
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.entities += len(request.entities)
+            self.bytes += request.ByteSize()
+            for entity in request.entities:
+                kind = entity.WhichOneof("entity")
+                self.entity_types[kind] = self.entity_types.get(kind, 0) + 1
+            if self.first_request is None:
+                self.first_request = now
+            self.last_request = now
+        return ingester_pb2.IngestResponse(errors=[])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "diode_requests": self.requests,
+                "diode_entities": self.entities,
+                "diode_bytes": self.bytes,
+                "diode_entity_types": dict(self.entity_types),
+            }
+
+
+def start_fake_diode(latency=0.0, host="127.0.0.1", port=0, workers=8):
+    """
+    Start a local gRPC server implementing the Diode IngesterService.
+    Returns (server, servicer, bound port).
+    """
+    servicer = FakeDiodeServicer(latency)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=workers),
+        options=[("grpc.max_receive_message_length", 64 * 1024 * 1024)],
+    )
+    ingester_pb2_grpc.add_IngesterServiceServicer_to_server(servicer, server)
+    bound_port = server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, servicer, bound_port
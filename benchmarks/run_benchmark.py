@@ -0,0 +1,186 @@
+"""
+Scaling benchmark for the Catalyst Center to Diode agent.
+
+Runs get_device_data and prepare_data against a local fake Catalyst Center
+(HTTP) and a local fake Diode ingest endpoint (gRPC) with synthetic
+inventories, and reports throughput, API calls, ingest volume and peak RSS.
+
+    python benchmarks/run_benchmark.py --devices 1000 10000 50000 --catc-latency 0.02
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the Catalyst Center to Diode agent against local fakes")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1000], help="Inventory sizes to run (default: 1000)")
+    parser.add_argument("--interfaces-per-device", type=int, default=52, help="Interfaces per switch/router (default: 52)")
+    parser.add_argument("--catc-latency", type=float, default=0.02, help="Seconds added to every Catalyst Center request (default: 0.02)")
+    parser.add_argument("--diode-latency", type=float, default=0.0, help="Seconds added to every Diode ingest request (default: 0)")
+    parser.add_argument("--catc-workers", type=int, default=8, help="Concurrent Catalyst Center requests (default: 8)")
+    parser.add_argument("--diode-workers", type=int, default=2, help="Diode ingestion workers (default: 2)")
+    parser.add_argument("--bulk-interfaces", action="store_true", help="Use the bulk interface listing")
+    parser.add_argument("--skip-interfaces", action="store_true", help="Skip interface collection")
+    parser.add_argument("--json", help="Also write the results as JSON to this path")
+    parser.add_argument("--log-level", default="WARNING", help="Agent log level (default: WARNING)")
+    return parser.parse_args()
+
+
+def _serve(config, ready):
+    from fake_catc import FakeCatalystCenter, SyntheticInventory
+    from fake_diode import start_fake_diode
+
+    inventory = SyntheticInventory(config["devices"], config["interfaces_per_device"])
+    diode_server, servicer, diode_port = start_fake_diode(config["diode_latency"])
+    catc = FakeCatalystCenter(inventory, config["catc_latency"])
+    catc.extra_stats = servicer.stats
+    ready.send((catc.url, diode_port))
+    catc.serve_forever()
+
+
+def _fetch_stats(url):
+    with urllib.request.urlopen(f"{url}/_stats") as response:
+        return json.load(response)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _run_agent(config, catc_url, diode_port, results):
+    from catc_connector import connect_to_catc
+    from catc_fetcher import get_device_data
+    from data_conversion import prepare_data
+    from diode_ingest import IngestPipeline
+    from site_cache import SiteCache
+    from transformer import Transformer
+    from netboxlabs.diode.sdk import DiodeClient
+
+    os.chdir(REPO_ROOT)
+    os.environ.setdefault("DIODE_API_KEY", "benchmark")
+    logging.basicConfig(level=config["log_level"], format="%(asctime)s - %(levelname)s - %(message)s")
+    result = {"devices": config["devices"]}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        transformer = Transformer("includes/site_rules.yml", "includes/skip_device_rules.yml")
+        site_cache = SiteCache(os.path.join(workdir, "site_cache.db"))
+
+        started = time.monotonic()
+        catc = connect_to_catc(catc_url, "benchmark", "benchmark", False)
+        result["auth_seconds"] = round(time.monotonic() - started, 3)
+
+        before = _fetch_stats(catc_url)
+        started = time.monotonic()
+        devices = get_device_data(
+            catc, logging, config["skip_interfaces"], config["catc_workers"], config["bulk_interfaces"],
+            site_cache, transformer=transformer,
+        )
+        fetch_seconds = time.monotonic() - started
+        after = _fetch_stats(catc_url)
+        result.update({
+            "collected_devices": len(devices),
+            "fetch_seconds": round(fetch_seconds, 3),
+            "fetch_devices_per_second": round(len(devices) / fetch_seconds, 1) if fetch_seconds else None,
+            "catc_calls": after["catc_total_calls"] - before["catc_total_calls"],
+            "catc_calls_by_endpoint": {
+                endpoint: count - before["catc_calls"].get(endpoint, 0)
+                for endpoint, count in after["catc_calls"].items()
+            },
+            "peak_rss_mb_after_fetch": _peak_rss_mb(),
+        })
+
+        ingestor = IngestPipeline(
+            lambda: DiodeClient(target=f"grpc://127.0.0.1:{diode_port}", app_name="diode-catc-benchmark", app_version="0"),
+            config["diode_workers"],
+        )
+        started = time.monotonic()
+        prepare_data(ingestor, devices, logging, config["skip_interfaces"], transformer=transformer)
+        transform_seconds = time.monotonic() - started
+        ingestor.close()
+        ingest_seconds = time.monotonic() - started
+        diode = _fetch_stats(catc_url)
+        result.update({
+            "transform_seconds": round(transform_seconds, 3),
+            "transform_devices_per_second": round(len(devices) / transform_seconds, 1) if transform_seconds else None,
+            "ingest_seconds": round(ingest_seconds, 3),
+            "diode_requests": diode["diode_requests"],
+            "diode_entities": diode["diode_entities"],
+            "diode_megabytes": round(diode["diode_bytes"] / 1024 / 1024, 2),
+            "diode_entity_types": diode["diode_entity_types"],
+            "ingest_entities_per_second": round(diode["diode_entities"] / ingest_seconds, 1) if ingest_seconds else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        })
+        site_cache.close()
+
+    results.put(result)
+
+
+def run_size(args, devices):
+    """
+    Run one inventory size with the fakes and the agent in separate
+    processes so peak RSS reflects the agent alone.
+    """
+    config = {
+        "devices": devices,
+        "interfaces_per_device": args.interfaces_per_device,
+        "catc_latency": args.catc_latency,
+        "diode_latency": args.diode_latency,
+        "catc_workers": args.catc_workers,
+        "diode_workers": args.diode_workers,
+        "bulk_interfaces": args.bulk_interfaces,
+        "skip_interfaces": args.skip_interfaces,
+        "log_level": args.log_level,
+    }
+    context = multiprocessing.get_context("spawn")
+    ready_recv, ready_send = context.Pipe(duplex=False)
+    servers = context.Process(target=_serve, args=(config, ready_send), daemon=True)
+    servers.start()
+    try:
+        catc_url, diode_port = ready_recv.recv()
+        results = context.Queue()
+        agent = context.Process(target=_run_agent, args=(config, catc_url, diode_port, results))
+        agent.start()
+        result = results.get()
+        agent.join()
+        return result
+    finally:
+        servers.terminate()
+        servers.join()
+
+
+def main():
+    args = parse_arguments()
+    results = []
+    for devices in args.devices:
+        print(f"Running benchmark with {devices} devices...", flush=True)
+        result = run_size(args, devices)
+        results.append(result)
+        print(
+            f"  fetch:  {result['fetch_seconds']}s, {result['fetch_devices_per_second']} devices/s, "
+            f"{result['catc_calls']} Catalyst Center calls {result['catc_calls_by_endpoint']}\n"
+            f"  ingest: {result['transform_seconds']}s transform, {result['ingest_seconds']}s total, "
+            f"{result['diode_entities']} entities in {result['diode_requests']} requests "
+            f"({result['diode_megabytes']} MB), {result['ingest_entities_per_second']} entities/s\n"
+            f"  memory: {result['peak_rss_mb_after_fetch']} MB peak RSS after fetch, {result['peak_rss_mb']} MB overall",
+            flush=True,
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Micro-benchmark of the interface/IP transformation.
+
+Converts the interfaces of a synthetic inventory with the per-interface
+code prepare_data used before the table-driven fast path (reproduced
+below as the baseline) and with build_interface_entities, checks that both
+produce the same entities, and reports interfaces/s for each. No network
+is involved.
+
+    python benchmarks/transform_benchmark.py --devices 200 --repeat 5
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import ipaddress
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark interface/IP transformation before and after the fast path")
+    parser.add_argument("--devices", type=int, default=200, help="Devices with interfaces to convert (default: 200)")
+    parser.add_argument("--interfaces-per-device", type=int, default=52, help="Interfaces per device (default: 52)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed passes of each implementation, best is kept (default: 5)")
+    return parser.parse_args()
+
+
+def baseline_infer_interface_type(port_name, speed):
+    speed_to_type_map = {
+        100: "100base-t",
+        1000: "1000base-t",
+        10000: "10gbase-x-sfpp",
+        25000: "25gbase-x-sfp28",
+        40000: "40gbase-x-qsfpp",
+        100000: "100gbase-x-qsfp28",
+    }
+    if "E" in port_name:
+        return speed_to_type_map.get(speed)
+    elif "channel" in port_name:
+        return "lag"
+    return "virtual"
+
+
+def baseline_get_cidr(ip, mask):
+    prefix_length = ipaddress.IPv4Network(f"0.0.0.0/{mask}").prefixlen
+    return f"{ip}/{prefix_length}"
+
+
+def baseline_get_network_addr(ip, mask):
+    network = ipaddress.IPv4Network(f"{ip}/{mask}", strict=False)
+    return f"{network.network_address}/{network.prefixlen}"
+
+
+def baseline_interface_entities(interfaces, device_entity, device_name, site_name):
+    """
+    The per-interface loop of build_device_entities before the fast path.
+    """
+    from netboxlabs.diode.sdk.ingester import Interface, IPAddress, Prefix, Entity
+    from data_conversion import TAGS, _site
+
+    entities = []
+    for interface in interfaces:
+        interface_entity = Interface(
+            name=interface.get("portName"),
+            mac_address=interface.get("macAddress"),
+            device=device_entity,
+            description=f"{device_name}: {interface.get('portName')} ({interface.get('description')})",
+            type=baseline_infer_interface_type(interface.get("portName"), interface.get("speed")),
+            speed=int(interface.get("speed", 0)),
+            enabled=True if 'status' in interface and interface.get("status") in ["connected", "up", "reachable"] else False,
+            mtu=int(interface.get("mtu")),
+            tags=TAGS,
+        )
+        entities.append(Entity(interface=interface_entity))
+        logging.debug(f"Processed interface: {interface.get('portName')}")
+        if interface.get('ipv4Address'):
+            ip_data = IPAddress(
+                address=baseline_get_cidr(interface.get('ipv4Address'), interface.get('ipv4Mask')),
+                interface=interface_entity,
+                device=device_entity,
+                description=f"{interface_entity.description}",
+                tags=TAGS,
+            )
+            entities.append(Entity(ip_address=ip_data))
+            if 'Vlan' in interface.get('portName'):
+                prefix_entity = Prefix(
+                    prefix=baseline_get_network_addr(interface.get('ipv4Address'), interface.get('ipv4Mask')),
+                    site=_site(site_name),
+                    description=f"{interface.get('portName')}: {interface.get('description')} ({site_name})",
+                    status='active',
+                    tags=TAGS,
+                )
+                entities.append(Entity(prefix=prefix_entity))
+    return entities
+
+
+def _best_rate(label, convert, devices, interface_count, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for device_entity, device_name, interfaces in devices:
+            convert(interfaces, device_entity, device_name)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rate = interface_count / best
+    print(f"{label:<10} {interface_count:>8} interfaces  {best:8.3f} s  {rate:>10,.0f} interfaces/s")
+    return rate
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING)
+    os.chdir(REPO_ROOT)
+
+    from netboxlabs.diode.sdk.ingester import Device
+    from fake_catc import SyntheticInventory
+    from records import InterfaceRecord
+    from transformer import Transformer
+    from data_conversion import build_interface_entities
+
+    transformer = Transformer("includes/site_rules.yml", "includes/skip_device_rules.yml")
+    site_name = "Building 0"
+    inventory = SyntheticInventory(args.devices * 4 // 3 + 4, args.interfaces_per_device)
+    devices = []
+    for index in inventory.interface_devices()[:args.devices]:
+        device_name = f"device-{index}"
+        devices.append((
+            Device(name=device_name, site=site_name),
+            device_name,
+            [InterfaceRecord.from_sdk(interface) for interface in inventory.interfaces(index)],
+        ))
+    interface_count = sum(len(interfaces) for _, _, interfaces in devices)
+
+    def _before(interfaces, device_entity, device_name):
+        return baseline_interface_entities(interfaces, device_entity, device_name, site_name)
+
+    def _after(interfaces, device_entity, device_name):
+        return build_interface_entities(interfaces, device_entity, device_name, site_name, transformer, logging)
+
+    for device_entity, device_name, interfaces in devices:
+        if _before(interfaces, device_entity, device_name) != _after(interfaces, device_entity, device_name):
+            raise SystemExit(f"Entities differ for {device_name}")
+
+    before = _best_rate("before", _before, devices, interface_count, args.repeat)
+    after = _best_rate("after", _after, devices, interface_count, args.repeat)
+    print(f"speedup    {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
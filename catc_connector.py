@@ -1,16 +1,36 @@
 from dnacentersdk import api
 
-def connect_to_catc(host, username, password, verify=True):
+from rate_limit import tune_session
+
+def connect_to_catc(host, username, password, verify=True, workers=8, rate_limit=None):
     """
     Establishes a connection to Cisco Catalyst Center and returns the SDK client.
+    host may also be a full base URL such as http://127.0.0.1:8080.
+    The HTTP session gets a keep-alive pool for workers concurrent requests,
+    an optional rate_limit in requests per second, and adaptive concurrency
+    that backs off on 429s (see rate_limit.py).
     """
     try:
         catc = api.DNACenterAPI(
-            base_url=f"https://{host}",
+            base_url=host if "://" in host else f"https://{host}",
             username=username,
             password=password,
             verify=verify
         )
+        tune_session(catc.session._req_session, workers, rate_limit)
         return catc
     except Exception as e:
         raise ConnectionError(f"Failed to connect to Cisco Catalyst Center: {e}")
+
+
+def refresh_catc_token(catc, host, username, password, verify=True, workers=8, rate_limit=None):
+    """
+    Fetch a new access token for an existing Catalyst Center client, keeping
+    its HTTP session. Falls back to building a new client if the SDK cannot
+    refresh in place. Returns the client to use from now on.
+    """
+    try:
+        catc.session.refresh_token()
+        return catc
+    except Exception:
+        return connect_to_catc(host, username, password, verify, workers, rate_limit)
@@ -1,33 +1,150 @@
 import re
-import os
-import json
+import fnmatch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from transformer import Transformer
+from site_cache import SiteCache
+from metrics import METRICS
+from records import DeviceRecord, InterfaceRecord
 
-def get_device_data(client,logging,skip_interfaces=False):
+PAGE_LIMIT = 500
 
-    SITE_CACHE_FILE = "./site_cache.json"
-    transformer = Transformer("includes/site_rules.yml","includes/skip_device_rules.yml")
+def fetch_paged(fetch_page, total, logging, label, workers=1, limit=PAGE_LIMIT, project=None):
+    """
+    Fetch every page of an offset/limit paginated Catalyst Center listing
+    concurrently and return the rows in offset order. Rows are passed
+    through project (e.g. DeviceRecord.from_sdk) page by page, so the raw
+    responses can be freed as the listing is fetched.
+    """
+
+    def _fetch(offset, size):
+        response = fetch_page(offset=offset, limit=size)
+        return response['response'] or []
+
+    offsets = list(range(1, total + 1, limit))
+    items = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(offsets) or 1))) as executor:
+        for offset, page in zip(offsets, executor.map(lambda offset: _fetch(offset, limit), offsets)):
+            # Never let an oversized page overlap the next one
+            page = page[:limit]
+            # A short page in the middle of the listing leaves a gap; fill it
+            # in before moving on so rows stay in offset order
+            end = min(offset + limit, total + 1)
+            while page and offset + len(page) < end:
+                missing = _fetch(offset + len(page), end - offset - len(page))
+                if not missing:
+                    break
+                page.extend(missing[:end - offset - len(page)])
+            items.extend(page if project is None else map(project, page))
+            logging.debug(f"Retrieved {len(items)} {label}")
+
+    if len(items) != total:
+        logging.warning(f"Expected {total} {label} but Catalyst Center returned {len(items)}")
+    return items
+
+def fetch_pages_until_short(fetch_page, logging, label, limit=PAGE_LIMIT, project=None, **params):
+    """
+    Fetch an offset/limit paginated listing whose size is not known up
+    front, such as a filtered device list, one page at a time until a
+    short page.
+    """
+    items = []
+    offset = 1
+    while True:
+        response = fetch_page(offset=offset, limit=limit, **params)
+        page = response['response'] or []
+        items.extend(page if project is None else map(project, page))
+        logging.debug(f"Retrieved {len(items)} {label}")
+        if len(page) < limit:
+            return items
+        offset += limit
+
+
+def hostname_regex(pattern):
+    """
+    Translate a hostname glob (bldg12-*, c9300-??) into the regular
+    expression syntax of the Catalyst Center hostname filter.
+    """
+    return "".join(".*" if char == "*" else "." if char == "?" else re.escape(char) for char in pattern)
 
-    def _load_site_cache():
-        if os.path.exists(SITE_CACHE_FILE):
-            with open(SITE_CACHE_FILE, "r") as file:
-                try:
-                    site_cache = json.load(file)
-                    logging.debug(f"Loaded site cache from {SITE_CACHE_FILE}")
-                    return site_cache
-                except json.JSONDecodeError as e:
-                    logging.error(f"Could not decode site cache file: {e}")
-      
-        logging.error(f"No cache found at {SITE_CACHE_FILE}")                    
-        return {}  # Return an empty cache if the file doesn't exist or is invalid
-
-    def _save_site_cache(site_cache):
-        try:
-            with open(SITE_CACHE_FILE, "w") as file:
-                json.dump(site_cache, file, indent=4)
-                logging.debug(f"Saved site cache to {SITE_CACHE_FILE}")
-        except Exception as e:
-            logging.error(f"Failed to save site cache: {e}")
+
+def device_query_parameters(filters):
+    """
+    get_device_list query parameters for the family, role and hostname
+    filters, and the device id and management IP lists used to refetch
+    the devices named by Catalyst Center events.
+    """
+    query = {}
+    if filters.get('id'):
+        query['id'] = ",".join(filters['id'])
+    if filters.get('ip'):
+        query['management_ip_address'] = list(filters['ip'])
+    if filters.get('family'):
+        query['family'] = filters['family']
+    if filters.get('role'):
+        # Catalyst Center roles are upper case (ACCESS, DISTRIBUTION, ...)
+        query['role'] = [role.upper() for role in filters['role']]
+    if filters.get('hostname'):
+        query['hostname'] = hostname_regex(filters['hostname'])
+    return query
+
+
+def device_matches(device, filters):
+    """
+    Client-side check of the family and role lists and the hostname glob,
+    for listings that cannot filter on them server-side.
+    """
+    if filters.get('id') and device.get('id') not in filters['id']:
+        return False
+    if filters.get('ip') and device.get('managementIpAddress') not in filters['ip']:
+        return False
+    if filters.get('family') and device.get('family') not in filters['family']:
+        return False
+    if filters.get('role') and (device.get('role') or '').upper() not in [role.upper() for role in filters['role']]:
+        return False
+    if filters.get('hostname') and not fnmatch.fnmatchcase(device.get('hostname') or '', filters['hostname']):
+        return False
+    return True
+
+def get_device_data(client,logging,skip_interfaces=False,workers=1,bulk_interfaces=False,site_cache=None,sync_state=None,transformer=None):
+    """
+    Collect the complete device inventory as a list.
+    """
+    return list(iter_device_data(client, logging, skip_interfaces, workers, bulk_interfaces, site_cache, sync_state, transformer=transformer))
+
+def iter_device_data(client,logging,skip_interfaces=False,workers=1,bulk_interfaces=False,site_cache=None,sync_state=None,max_in_flight=200,transformer=None,stop_event=None,recorder=None,filters=None,checkpoint=None,shard=None,port_index=None):
+    """
+    Yield devices, with site and interfaces attached, in device list order as
+    soon as they are collected. At most max_in_flight devices are being
+    fetched or waiting to be consumed at any time, which bounds memory and
+    lets the consumer transform and ingest while fetching continues.
+    Once stop_event is set no new devices are started; the ones already in
+    flight are still yielded.
+    Sites and collected devices are also written to recorder (a
+    SnapshotWriter) when one is given, as the raw Catalyst Center rows,
+    which are kept until each device is written.
+    filters (site, family, role, hostname; see device_matches) limit the
+    sync to the matching devices and are pushed down to Catalyst Center as
+    query parameters, so a targeted sync only touches its subset.
+    Devices a resumed checkpoint already ingested are not collected again,
+    and collected devices are recorded in it.
+    With a shard (sharding.Shard) only the devices it owns are collected,
+    and they are picked before any site request. Devices are assigned by
+    their hostname site prefix, so the devices of a building, which share
+    its subnets, land on the same shard and its prefixes are sent by one
+    node (unless hostnames on one subnet give different prefixes). Other
+    shards' devices whose site is known are added to port_index, when one
+    is given, so cables to them resolve; only then is site membership
+    listed.
+    Sites resolved from membership are written to site_cache by hostname
+    prefix.
+    """
+    filters = {key: value for key, value in (filters or {}).items() if value}
+
+    if transformer is None:
+        transformer = Transformer("includes/site_rules.yml","includes/skip_device_rules.yml")
+    if site_cache is None:
+        site_cache = SiteCache()
 
     def _extract_site_prefix(hostname):
         try:
@@ -54,84 +171,325 @@ def get_device_data(client,logging,skip_interfaces=False):
             logging.error(f"Regex error processing hostname {hostname}: {e}")
             return hostname
 
-    
-    response = client.devices.get_device_count()
-    device_count = response['response']
-    logging.info(f'Retrieving {device_count} devices from Cisco Catalyst Center')
-    offset = 1
-    limit = 500
-    device_list = []
-    items=0
-    while offset <= device_count:
-        response = client.devices.get_device_list(offset=offset)
-        offset += limit
-        device_list.extend(response['response'])
-        items += limit
-        logging.debug(f"Retrieved {items} devices")
-    logging.info('Collected complete device list from Cisco Catalyst Center')
+    # Raw device and interface rows by device id, only while recording
+    raw_devices = {} if recorder is not None else None
+    raw_interfaces = {} if recorder is not None else None
 
+    def _project_device(row):
+        device = DeviceRecord.from_sdk(row)
+        if raw_devices is not None:
+            raw_devices[device['id']] = row
+        return device
 
-    response = client.sites.get_site_count()
-    site_count = response['response']    
-    logging.info(f'Retrieving {site_count} sites from Cisco Catalyst Center (this takes a while)')
-    offset = 1
-    limit = 500
-    site_list = []
-    items=0
-    while offset <= site_count:
-        response = client.sites.get_site(offset=offset)
-        offset += limit
-        site_list.extend(response['response'])
-        items += limit
-        logging.debug(f"Retrieved {items} sites")
-    
-    device_inventory = []
-    items=0
-    site_cache = _load_site_cache()  # Load cache at startup
+    def _project_interface(row):
+        interface = InterfaceRecord.from_sdk(row)
+        if raw_interfaces is not None and (shard is None or interface.get('deviceId') in owned_ids):
+            raw_interfaces.setdefault(interface.get('deviceId'), []).append(row)
+        return interface
+
+    def _build_site_index(site_list):
+        # site id -> full hierarchy name (e.g. Global/Area/Building/Floor)
+        site_index = {}
+        for site in site_list:
+            hierarchy = site.get('siteNameHierarchy')
+            if site.get('id') and hierarchy:
+                site_index[site['id']] = hierarchy
+        return site_index
+
+    def _page_membership(site_id, site_index, device_family=None):
+        # (device id, site id, row) for the devices of the site and its
+        # children, one page at a time; child sites the responses describe
+        # are added to site_index
+        seen = set()
+        offset = 1
+        while True:
+            response = client.sites.get_membership(site_id=site_id, device_family=device_family, offset=offset, limit=PAGE_LIMIT)
+            site_index.update(_build_site_index((response.get('site') or {}).get('response') or []))
+            rows = 0
+            known = len(seen)
+            for entry in response.get('device') or []:
+                member_site = entry.get('siteId') or site_id
+                for member in entry.get('response') or []:
+                    rows += 1
+                    device_id = member.get('instanceUuid') or member.get('id')
+                    if device_id:
+                        seen.add(device_id)
+                        yield device_id, member_site, member
+            # A short page, or one with nothing new if offset is not honoured
+            if rows < PAGE_LIMIT or len(seen) == known:
+                return
+            offset += PAGE_LIMIT
+
+    def _resolve_device_sites(site_index):
+        # The membership of a root site (normally just Global) includes the
+        # devices of all its children, so one paged listing per root covers
+        # every device. Keep the most specific (deepest) site seen for each
+        device_sites = {}
+        roots = [site_id for site_id, hierarchy in site_index.items() if '/' not in hierarchy]
+        for root_id in roots:
+            try:
+                for device_id, site_id, _ in _page_membership(root_id, site_index):
+                    hierarchy = site_index.get(site_id)
+                    if hierarchy:
+                        _keep_deepest(device_sites, device_id, hierarchy)
+            except Exception as e:
+                logging.warning(f"Could not retrieve membership for site {site_index[root_id]}: {e}")
+        return device_sites
+
+    def _seed_site_cache(devices, device_sites):
+        # Sites resolved from membership let later filtered, shard and event
+        # syncs answer from the cache instead of a device detail call
+        seeded = set()
+        for device in devices:
+            hostname = device.get('hostname')
+            site = device_sites.get(device['id'])
+            if not hostname or not site:
+                continue
+            site_prefix = _extract_site_prefix(hostname)
+            if site_prefix != hostname and site_prefix not in seeded:
+                site_cache.set(site_prefix, site)
+                seeded.add(site_prefix)
+        return len(seeded)
+
+    def _keep_deepest(device_sites, device_id, hierarchy):
+        current = device_sites.get(device_id)
+        if current is None or hierarchy.count('/') > current.count('/'):
+            device_sites[device_id] = hierarchy
+
+    def _get_subtree(root_id, site_index):
+        # Devices of the site and its children straight from membership,
+        # with the family pushed down when there is one
+        families = filters.get('family') or []
+        device_family = families[0] if len(families) == 1 else None
+        devices = {}
+        device_sites = {}
+        for device_id, member_site, member in _page_membership(root_id, site_index, device_family):
+            if device_id not in devices:
+                devices[device_id] = DeviceRecord.from_sdk(member)
+                # Rows keyed by instanceUuid only still need an id
+                devices[device_id].id = device_id
+                if raw_devices is not None:
+                    raw_devices[device_id] = member
+            device_sites.setdefault(device_id, []).append(member_site)
+        # Child sites the membership response did not describe
+        for site_id in {site for sites in device_sites.values() for site in sites} - set(site_index):
+            site_index.update(_build_site_index(client.sites.get_site(site_id=site_id)['response'] or []))
+        resolved = {}
+        for device_id, sites in device_sites.items():
+            for site_id in sites:
+                if site_index.get(site_id):
+                    _keep_deepest(resolved, device_id, site_index[site_id])
+        return list(devices.values()), resolved
+
+    device_query = device_query_parameters(filters)
+    if filters.get('site'):
+        # Targeted sync of one site subtree: the site and its membership
+        # replace the full device, site and membership listings
+        with METRICS.stage("site_paging"):
+            site_list = client.sites.get_site(name=filters['site'])['response'] or []
+        site_index = _build_site_index(site_list)
+        if not site_index:
+            logging.error(f"Site {filters['site']} not found in Cisco Catalyst Center")
+            return
+        with METRICS.stage("device_paging"):
+            root_id = next((site_id for site_id, hierarchy in site_index.items() if hierarchy == filters['site']), next(iter(site_index)))
+            device_list, device_sites = _get_subtree(root_id, site_index)
+        site_list = [{'id': site_id, 'siteNameHierarchy': hierarchy} for site_id, hierarchy in site_index.items()]
+        device_list = [device for device in device_list if device_matches(device, filters)]
+        device_count = len(device_list)
+        logging.info(f"Retrieved {device_count} devices in {filters['site']} from Cisco Catalyst Center")
+    elif device_query:
+        # Filtered listings have no matching count, so page until a short page.
+        # Sites come from the cache or one device detail call per device
+        # rather than a sweep over every site's membership
+        with METRICS.stage("device_paging"):
+            logging.info(f'Retrieving devices matching {device_query} from Cisco Catalyst Center')
+            device_list = fetch_pages_until_short(
+                client.devices.get_device_list, logging, "devices", project=_project_device, **device_query
+            )
+        device_list = [device for device in device_list if device_matches(device, filters)]
+        device_count = len(device_list)
+        site_list = []
+        device_sites = {}
+        logging.info(f'Retrieved {device_count} matching devices from Cisco Catalyst Center')
+    else:
+        with METRICS.stage("device_paging"):
+            response = client.devices.get_device_count()
+            device_count = response['response']
+            logging.info(f'Retrieving {device_count} devices from Cisco Catalyst Center')
+            device_list = fetch_paged(
+                client.devices.get_device_list, device_count, logging, "devices", workers, project=_project_device
+            )
+        logging.info('Collected complete device list from Cisco Catalyst Center')
+        # Sites are resolved below, once the shard's devices are known
+        site_list = None
+
+    foreign = []
+    if shard is not None:
+        owned = []
+        for device in device_list:
+            if shard.owns(_extract_site_prefix(device.get('hostname') or device['id'])):
+                owned.append(device)
+            else:
+                foreign.append(device)
+        logging.info(f'Shard {shard} owns {len(owned)} of {len(device_list)} devices')
+        METRICS.set_gauge("shard_devices", len(owned))
+        device_list = owned
+        device_count = len(device_list)
+        owned_ids = {device['id'] for device in device_list}
+
+    if site_list is None and shard is not None and port_index is None:
+        # Like a filtered sync, the shard's devices get their site from the
+        # cache or device detail, rather than every shard sweeping the
+        # membership of every site
+        logging.info(f"Resolving sites for shard {shard} from the site cache and device details")
+        site_list = []
+        device_sites = {}
+    elif site_list is None:
+        with METRICS.stage("site_paging"):
+            response = client.sites.get_site_count()
+            site_count = response['response']    
+            logging.info(f'Retrieving {site_count} sites from Cisco Catalyst Center')
+            site_list = fetch_paged(client.sites.get_site, site_count, logging, "sites", workers)
+        with METRICS.stage("site_resolution"):
+            site_index = _build_site_index(site_list)
+            logging.info(f'Resolving device membership of {len(site_index)} sites')
+            device_sites = _resolve_device_sites(site_index)
+    if recorder is not None:
+        recorder.write_sites(site_list)
+    logging.info(f'Resolved sites for {len(device_sites)} devices from site membership')
+    if device_sites:
+        seeded = _seed_site_cache(device_list, device_sites) + _seed_site_cache(foreign, device_sites)
+        logging.debug(f'Cached the site of {seeded} hostname prefixes')
+
+    if port_index is not None:
+        # Other shards' devices only need a name and site to terminate a cable
+        for device in foreign:
+            hostname = device.get('hostname') or device['id']
+            if 'Unified AP' in (device.get('family') or ''):
+                continue
+            site = device_sites.get(device['id']) or site_cache.get(_extract_site_prefix(hostname))
+            if site and not transformer.should_skip_device(hostname):
+                port_index.add_device(
+                    device['id'], transformer.transform_name(hostname),
+                    transformer.site_to_site(transformer.extract_site(site)),
+                )
     
+    interface_index = {}
     if skip_interfaces:
         logging.info("Skipping Interface Collection")
-        
-    for device in device_list:
+    elif bulk_interfaces and filters:
+        logging.info("Retrieving interfaces per device for a filtered sync instead of the bulk listing")
+    elif bulk_interfaces:
+        with METRICS.stage("interface_fetch"):
+            response = client.devices.get_device_interface_count()
+            interface_count = response['response']
+            logging.info(f'Retrieving {interface_count} interfaces in bulk from Cisco Catalyst Center')
+            for interface in fetch_paged(
+                client.devices.get_all_interfaces, interface_count, logging, "interfaces", workers,
+                project=_project_interface,
+            ):
+                if shard is None or interface.get('deviceId') in owned_ids:
+                    interface_index.setdefault(interface.get('deviceId'), []).append(interface)
+        logging.info(f'Indexed interfaces for {len(interface_index)} devices')
+
+    def _collect_device(items, device):
         interfaces = []   
-        items += 1          
 
         try:
             hostname = device.get('hostname')
             if transformer.should_skip_device(hostname):
-                continue
+                return None
             
             logging.debug(f"Retrieving site name for device #{items}/{str(device_count)}: {hostname}")
             site_prefix = _extract_site_prefix(hostname)
-            if site_prefix in site_cache:
-                device.site = site_cache[site_prefix]
+            cached_site = None if device['id'] in device_sites else site_cache.get(site_prefix)
+            if device['id'] in device_sites:
+                device.site = device_sites[device['id']]
+                logging.debug(f"Using site membership {hostname}: {device.site}")
+            elif cached_site is not None:
+                device.site = cached_site
                 logging.debug(f"Using cache {site_prefix}: {device.site}")
             else:
                 response = client.devices.get_device_detail(identifier='uuid', search_by=device['id'])
                 device.site = response['response']['location']
                 logging.debug(f"Cache Miss: {hostname}: {device.site}")
                 if site_prefix != hostname:
-                    site_cache[site_prefix] = device.site
+                    site_cache.set(site_prefix, device.site)
                     logging.debug(f"CACHING prefix {site_prefix}")
-                    _save_site_cache(site_cache) 
                 
+            if sync_state is not None and sync_state.device_unchanged(device['id'], device.get('lastUpdateTime')):
+                device.unchanged = True
+                logging.debug(f"Unchanged since last sync, skipping interfaces for {hostname}")
             #AP have no interfaces in CATC    
-            if not 'Unified AP' in device.family and not skip_interfaces:
+            elif not 'Unified AP' in device.family and not skip_interfaces:
                 try:
-                    logging.debug(f"Retrieving interfaces for device #{items}/{str(device_count)}: {device['hostname']}")
-                    response = client.devices.get_interface_info_by_id(device_id=device['id'])        
-                    interfaces.extend(response['response'])  
+                    if device['id'] in interface_index:
+                        interfaces.extend(interface_index.pop(device['id']))
+                    else:
+                        # Not in the bulk listing (or bulk mode is off)
+                        logging.debug(f"Retrieving interfaces for device #{items}/{str(device_count)}: {device['hostname']}")
+                        with METRICS.stage("interface_fetch"):
+                            response = client.devices.get_interface_info_by_id(device_id=device['id'])        
+                        interfaces.extend(InterfaceRecord.from_sdk(interface) for interface in response['response'])
+                        if raw_interfaces is not None:
+                            raw_interfaces[device['id']] = response['response']
                     device.interfaces=interfaces
                     logging.debug(f"Found {len(interfaces)} interfaces for {device['hostname']}")
-                except:
-                    logging.debug(f"No interfaces found for device {device['hostname']}")
-                    continue
+                except Exception as e:
+                    # Throttling is already retried by the HTTP layer, so this is a real failure
+                    logging.warning(f"Failed to retrieve interfaces for {device['hostname']}, skipping device: {e}")
+                    METRICS.inc("interface_fetch_errors_total")
+                    return None
     
         except Exception as e:
             logging.error(f"An error occurred collecting device data: {device.get('hostname')} {e}")
-            continue
+            return None
         
-        device_inventory.append(device)
+        return device
+
+    # Each worker resolves the site and pulls interfaces for one device.
+    # Devices are handed out of device_list as they are submitted so nothing
+    # but the in-flight window keeps a reference to their interfaces.
+    logging.info(f"Collecting device details using {workers} worker(s)")
+    pending_devices = deque(device_list)
+    device_list = None
+    in_flight = deque()
+    collected = 0
+    resumed = 0
+    items = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending_devices or in_flight:
+            if stop_event is not None and stop_event.is_set() and pending_devices:
+                logging.warning(f"Stopping collection early, {len(pending_devices)} devices not collected")
+                pending_devices.clear()
+            while pending_devices and len(in_flight) < max(1, max_in_flight):
+                device = pending_devices.popleft()
+                items += 1
+                if checkpoint is not None and checkpoint.is_acknowledged(device['id']):
+                    resumed += 1
+                    continue
+                in_flight.append(executor.submit(_collect_device, items, device))
+            if not in_flight:
+                break
+            device = in_flight.popleft().result()
+            if device is not None:
+                collected += 1
+                if recorder is not None:
+                    recorder.write_device(
+                        device, raw_devices.pop(device['id'], None), raw_interfaces.pop(device['id'], None)
+                    )
+                if checkpoint is not None:
+                    checkpoint.mark_fetched(device['id'])
+                yield device
     
-    logging.info('Collected complete site list from Cisco Catalyst Center')
-    return device_inventory
+    site_cache.flush()
+    site_cache_stats = site_cache.stats()
+    for name in ("hits", "misses", "expired", "entries", "hit_rate"):
+        METRICS.set_gauge(f"site_cache_{name}", site_cache_stats[name])
+    METRICS.set_gauge("collected_devices", collected)
+    logging.info(f"Site cache stats: {site_cache_stats}")
+    if resumed:
+        METRICS.set_gauge("resumed_devices", resumed)
+        logging.info(f'Skipped {resumed} devices already ingested before the checkpoint')
+    logging.info(f'Collected {collected} devices from Cisco Catalyst Center')
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+# Fetched device ids are written in groups of this many
+FETCHED_FLUSH_SIZE = 500
+
+class Checkpoint:
+    def __init__(self, path="./checkpoint.jsonl", resume=False, scope=None):
+        """
+        Progress of a sync, appended as one JSON line per event so a run
+        that dies part way can be resumed: the devices fetched and the
+        devices whose entity batches Diode acknowledged. Each line is
+        written with a single write and fsync; a torn last line from a
+        crash is ignored on load. A new run replaces the file atomically.
+
+        With resume=True the acknowledged devices of an unfinished run with
+        the same scope (filters and controllers) are loaded, and the sync
+        skips them.
+        """
+        self.path = path
+        self.scope = scope
+        self.acknowledged = set()
+        self.fetched = set()
+        self.resumed = 0
+        self._lock = threading.Lock()
+        self._fetched_buffer = []
+        self._file = None
+        self._run = None
+        self._submitted = 0
+        self._acked_batches = 0
+        self._finished = False
+        if resume:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logging.info(f"No checkpoint at {self.path}, starting from the beginning")
+            return
+        run = None
+        complete = False
+        acknowledged = set()
+        fetched = set()
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write at the end of a crashed run
+                    break
+                if record["type"] == "run":
+                    run = record
+                elif run is None or record.get("run") != run["run"]:
+                    continue
+                elif record["type"] == "acked":
+                    acknowledged.update(record["devices"])
+                elif record["type"] == "fetched":
+                    fetched.update(record["devices"])
+                elif record["type"] == "complete":
+                    complete = True
+        if run is None or complete:
+            logging.info(f"Checkpoint {self.path} has no unfinished run, starting from the beginning")
+        elif run.get("scope") != self.scope:
+            logging.warning(f"Checkpoint {self.path} is for a different sync scope, starting from the beginning")
+        else:
+            self.acknowledged = acknowledged
+            self.resumed = len(acknowledged)
+            logging.info(
+                f"Resuming run {run['run']} from {self.path}: {len(acknowledged)} devices already ingested, "
+                f"{len(fetched)} fetched"
+            )
+
+    def start(self):
+        """
+        Begin a run: atomically replace the checkpoint with a header that
+        carries over the acknowledged devices being resumed.
+        """
+        if self._file is not None:
+            self.close()
+        with self._lock:
+            self._run = uuid.uuid4().hex
+            self.fetched = set()
+            self._fetched_buffer = []
+            self._submitted = 0
+            self._acked_batches = 0
+            self._finished = False
+            temporary = f"{self.path}.tmp"
+            with open(temporary, "w") as file:
+                file.write(json.dumps({"type": "run", "run": self._run, "scope": self.scope, "started": time.time()}) + "\n")
+                if self.acknowledged:
+                    file.write(json.dumps({"type": "acked", "run": self._run, "devices": sorted(self.acknowledged)}) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+            self._file = open(self.path, "a")
+
+    def _append(self, record):
+        # Called with the lock held
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def is_acknowledged(self, device_id):
+        return device_id in self.acknowledged
+
+    def mark_fetched(self, device_id):
+        with self._lock:
+            self.fetched.add(device_id)
+            self._fetched_buffer.append(device_id)
+            if len(self._fetched_buffer) >= FETCHED_FLUSH_SIZE:
+                self._flush_fetched()
+
+    def _flush_fetched(self):
+        if self._fetched_buffer and self._file is not None:
+            self._append({"type": "fetched", "run": self._run, "devices": self._fetched_buffer})
+            self._fetched_buffer = []
+
+    def batch_submitted(self):
+        with self._lock:
+            self._submitted += 1
+        return self._run
+
+    def acknowledge(self, device_ids, run):
+        """
+        Record that Diode accepted the batch holding these devices'
+        entities. Late acknowledgements from an earlier run are dropped.
+        """
+        with self._lock:
+            if run != self._run or self._file is None:
+                return
+            self._acked_batches += 1
+            self.acknowledged.update(device_ids)
+            self._flush_fetched()
+            self._append({"type": "acked", "run": self._run, "devices": list(device_ids)})
+
+    def finish(self):
+        """
+        Mark that every device of the run has been handed to ingestion.
+        """
+        with self._lock:
+            self._finished = True
+
+    def close(self):
+        """
+        Call once ingestion has drained. A run that fetched everything and
+        had every batch acknowledged is marked complete, so the next
+        --resume starts over.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush_fetched()
+            if self._finished and self._acked_batches == self._submitted:
+                self._append({"type": "complete", "run": self._run})
+                logging.info(f"Sync run complete, checkpoint {self.path} closed")
+            else:
+                logging.warning(
+                    f"Sync run incomplete, {len(self.acknowledged)} devices ingested: continue it with --resume true"
+                )
+            self._file.close()
+            self._file = None
+            # Only a run loaded with resume=True skips devices
+            self.acknowledged = set()
@@ -0,0 +1,171 @@
+import os
+import time
+import queue
+import logging
+import threading
+import yaml
+
+from catc_connector import connect_to_catc, refresh_catc_token
+from metrics import METRICS, InstrumentedClient
+
+class Controller:
+    def __init__(self, name, host, username, password, verify=True, workers=8, rate_limit=None):
+        """
+        One Catalyst Center cluster with its own SDK session and concurrency
+        budget (workers and rate_limit).
+        """
+        self.name = name
+        self.host = host
+        self.username = username
+        self.password = password
+        self.verify = verify
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.catc = None
+        self._raw_catc = None
+        self._token_time = None
+
+    def ensure_session(self, token_lifetime):
+        """
+        Connect, or refresh the access token once it is older than
+        token_lifetime seconds. Returns False when the controller cannot be
+        reached, so the others can still be synced.
+        """
+        try:
+            if self._raw_catc is None:
+                logging.debug(f"Attempting to connect to Catalyst Center {self.name} at {self.host}...")
+                with METRICS.stage("auth"):
+                    self._raw_catc = connect_to_catc(
+                        self.host, self.username, self.password, self.verify, self.workers, self.rate_limit
+                    )
+                logging.info(f"Successfully connected to Catalyst Center {self.name}.")
+            elif time.monotonic() - self._token_time > token_lifetime:
+                logging.info(f"Refreshing Catalyst Center {self.name} access token...")
+                with METRICS.stage("auth"):
+                    self._raw_catc = refresh_catc_token(
+                        self._raw_catc, self.host, self.username, self.password, self.verify,
+                        self.workers, self.rate_limit,
+                    )
+            else:
+                return True
+        except Exception as e:
+            logging.error(f"Failed to connect to Catalyst Center {self.name}: {e}")
+            METRICS.inc("controller_errors_total", {"controller": self.name})
+            self._raw_catc = None
+            self.catc = None
+            return False
+        self.catc = InstrumentedClient(self._raw_catc, METRICS)
+        self._token_time = time.monotonic()
+        return True
+
+
+def load_controllers(args):
+    """
+    Build the controllers to sync: every entry of the --controllers YAML
+    file, or the single controller given by --catc-host. Entries default
+    to the command line settings, and the password may be taken from an
+    environment variable:
+
+        controllers:
+          - name: campus
+            host: catc1.example.edu
+            user: diode
+            password_env: CATC_CAMPUS_PASSWORD
+            workers: 16
+            rate_limit: 20
+    """
+    if not args.controllers:
+        return [Controller(
+            args.catc_host, args.catc_host, args.catc_user, args.catc_password, args.catc_verify,
+            args.catc_workers, args.catc_rate_limit,
+        )]
+
+    with open(args.controllers, "r") as f:
+        entries = (yaml.safe_load(f) or {}).get("controllers") or []
+    controllers = []
+    for position, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get("host"):
+            raise ValueError(f"Controller {position} in {args.controllers} must be a mapping with a host")
+        password = os.getenv(entry["password_env"]) if entry.get("password_env") else entry.get("password")
+        workers = entry.get("workers")
+        rate_limit = entry.get("rate_limit", args.catc_rate_limit)
+        try:
+            workers = int(workers) if workers is not None else args.catc_workers
+            # An empty rate_limit means no limit, like 0
+            rate_limit = float(rate_limit) if rate_limit is not None else None
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"Controller {entry.get('name', entry['host'])} in {args.controllers} has an invalid "
+                f"workers ({entry.get('workers')!r}) or rate_limit ({entry.get('rate_limit')!r})"
+            )
+        controllers.append(Controller(
+            entry.get("name", entry["host"]),
+            entry["host"],
+            entry.get("user", args.catc_user),
+            password or args.catc_password,
+            entry.get("verify", args.catc_verify),
+            workers,
+            rate_limit,
+        ))
+    names = [controller.name for controller in controllers]
+    if not controllers or len(set(names)) != len(names):
+        raise ValueError(f"{args.controllers} must list at least one controller, with unique names")
+    return controllers
+
+
+def merge_device_streams(streams, logging, max_in_flight=200, failed=None):
+    """
+    Consume several (controller name, device generator) streams
+    concurrently, one thread each, and yield devices as they arrive. A
+    device already yielded by another controller (same serial number, or
+    hostname when it has none) is dropped so it is only sent once. A
+    controller that fails is logged, added to the failed list when one is
+    given, and the others carry on.
+    """
+    output = queue.Queue(maxsize=max(1, max_in_flight))
+    closed = threading.Event()
+    done = object()
+
+    def _put(item):
+        # Give up if the consumer went away, rather than blocking forever
+        while not closed.is_set():
+            try:
+                output.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _pump(name, devices):
+        try:
+            for device in devices:
+                if not _put((name, device)):
+                    return
+        except Exception as e:
+            logging.error(f"An error occurred collecting devices from Catalyst Center {name}: {e}")
+            METRICS.inc("controller_errors_total", {"controller": name})
+            if failed is not None:
+                failed.append(name)
+        finally:
+            _put((name, done))
+
+    for name, devices in streams:
+        threading.Thread(target=_pump, args=(name, devices), name=f"catc-{name}", daemon=True).start()
+
+    owners = {}
+    remaining = len(streams)
+    try:
+        while remaining:
+            name, device = output.get()
+            if device is done:
+                remaining -= 1
+                continue
+            key = device.get("serialNumber") or device.get("hostname")
+            owner = owners.setdefault(key, name)
+            if owner != name:
+                logging.debug(f"Skipping {device.get('hostname')} from {name}, already collected from {owner}")
+                METRICS.inc("duplicate_devices_total", {"controller": name})
+                continue
+            yield device
+    finally:
+        closed.set()
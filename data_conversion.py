@@ -1,13 +1,130 @@
-from netboxlabs.diode.sdk.ingester import Device, Interface, IPAddress, Prefix, Entity
+from netboxlabs.diode.sdk.ingester import Device, Interface, IPAddress, Entity
+from netboxlabs.diode.sdk.diode.v1.ingester_pb2 import (
+    Entity as EntityMessage,
+    Tag as TagMessage,
+    Manufacturer as ManufacturerMessage,
+    DeviceType as DeviceTypeMessage,
+    Platform as PlatformMessage,
+    Role as RoleMessage,
+    Site as SiteMessage,
+    Interface as InterfaceMessage,
+    IPAddress as IPAddressMessage,
+    Prefix as PrefixMessage,
+)
 from transformer import Transformer
 import re
+import time
+from functools import lru_cache
+import logging as _logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from metrics import METRICS
 
-def prepare_data(client,devices,logging,skip_interfaces=False):
-    
-    transformer = Transformer("includes/site_rules.yml","includes/skip_device_rules.yml")
+# Devices handed to a transform worker per task, to amortize pickling overhead
+TRANSFORM_CHUNK_SIZE = 16
+
+# Shared sub-messages, built once and copied into each entity by protobuf
+# instead of being rebuilt from strings for every entity
+TAGS = [TagMessage(name="Diode-CATC-Agent"), TagMessage(name="Diode")]
+MANUFACTURER = ManufacturerMessage(name="Cisco")
+
+@lru_cache(maxsize=4096)
+def _device_type(model):
+    return DeviceTypeMessage(model=model, manufacturer=MANUFACTURER)
+
+@lru_cache(maxsize=4096)
+def _platform(name):
+    return PlatformMessage(name=name, manufacturer=MANUFACTURER)
+
+@lru_cache(maxsize=4096)
+def _role(name):
+    return RoleMessage(name=name)
+
+@lru_cache(maxsize=4096)
+def _site(name):
+    return SiteMessage(name=name)
+
+# speed and mtu come as a handful of distinct strings
+_as_int = lru_cache(maxsize=1024)(int)
+
+ENABLED_STATUSES = frozenset(("connected", "up", "reachable"))
+
+def build_interface_entities(interfaces, device_entity, device_name, site_name, transformer, logging):
+    """
+    Build the Interface, IPAddress and Prefix entities for all of a
+    device's interfaces in one call. Messages are built directly from the
+    protobuf classes with the lookups hoisted out of the loop, and the
+    type, prefix length and network address come from the transformer's
+    precomputed tables.
+    """
+    entities = []
+    append = entities.append
+    infer_interface_type = transformer.infer_interface_type
+    get_cidr = transformer.get_cidr
+    get_network_addr = transformer.get_network_addr
+    site = _site(site_name)
+    debug = _logging.getLogger().isEnabledFor(_logging.DEBUG)
+
+    for interface in interfaces:
+        port_name = interface.get("portName")
+        try:
+            speed = interface.get("speed", 0)
+            description = f"{device_name}: {port_name} ({interface.get('description')})"
+            interface_entity = InterfaceMessage(
+                name=port_name,
+                mac_address=interface.get("macAddress"),
+                device=device_entity,
+                description=description,
+                type=infer_interface_type(port_name, speed),
+                speed=_as_int(speed),
+                enabled=interface.get("status") in ENABLED_STATUSES,
+                mtu=_as_int(interface.get("mtu")),
+                tags=TAGS,
+            )
+            append(EntityMessage(interface=interface_entity))
+            #TODO: assign LAG members if port-channel
+
+            if debug:
+                logging.debug(f"Processed interface: {port_name}")
+
+            try:
+                ip = interface.get("ipv4Address")
+                address = get_cidr(ip, interface.get("ipv4Mask")) if ip else None
+                if address:
+                    append(EntityMessage(ip_address=IPAddressMessage(
+                        address=address,
+                        interface=interface_entity,
+                        description=description,
+                        tags=TAGS,
+                    )))
+
+                    if 'Vlan' in port_name:
+                        append(EntityMessage(prefix=PrefixMessage(
+                            prefix=get_network_addr(ip, interface.get("ipv4Mask")),
+                            site=site,
+                            description=f"{port_name}: {interface.get('description')} ({site_name})",
+                            status='active',
+                            tags=TAGS,
+                        )))
+
+                #TODO: Create VLAN when Diode Updated
+            except Exception as ip_error:
+                logging.error(f"Error processing IP: {ip_error}")
+
+        except Exception as interface_error:
+            logging.error(
+                f"Error processing interface {device_name} {port_name or 'unknown'}: {interface_error}"
+            )
+
+    return entities
+
+def build_device_entities(device, transformer, logging, skip_interfaces=False):
+    """
+    Build the Device, Interface, IPAddress and Prefix entities for one device.
+    """
     entities = []
 
-    
     #{'instanceUuid': '3dbe852a-1354-4d54-a77b-3219e995364b', 'instanceTenantId': '5f203c960f1a1c00c6926d61', 'deployPending': 'NONE', 'instanceVersion': 2, 
     # 'apEthernetMacAddress': '38:90:a5:f9:3d:cc', 'apManagerInterfaceIp': '172.19.3.84', 'associatedWlcIp': '172.19.3.84', 'collectionInterval': 'NA', 
     # 'collectionStatus': 'Managed', 'collectionTier': '', 'deviceSupportLevel': 'Supported', 'dnsResolvedManagementAddress': '', 'errorCode': 'null', 
@@ -18,161 +135,260 @@ def prepare_data(client,devices,logging,skip_interfaces=False):
     # 'reachabilityStatus': 'Reachable', 'reasonsForDeviceResync': '', 'reasonsForPendingSyncRequests': '', 'role': 'ACCESS', 'roleSource': 'AUTO', 
     # 'serialNumber': 'FJC2139M0TN', 'series': 'Cisco 2700E Series Unified Access Points', 'snmpContact': '', 'snmpLocation': 'Edisto Tower E', 
     # 'softwareVersion': '8.5.182.105', 'syncRequestedByApp': '', 'tagCount': '0', 'tunnelUdpPort': '16666', 'type': 'Cisco 2700E Unified Access Point', 
-    # 'upTime': '56 days, 13:35:07.570', 'uptimeSeconds': 4927533, 'vendor': 'NA'}  
-    if skip_interfaces:
-        logging.info("Skipping Discovery of Interfaces")
-        
-    for device in devices:
+    # 'upTime': '56 days, 13:35:07.570', 'uptimeSeconds': 4927533, 'vendor': 'NA'}
+
+    try:
+        # location = transformer.extract_location(device_data.get("site"))
+        # if len(location) < 1:
+        #     location = transformer.site_to_site(transformer.extract_site(device_data.get("site")))
+        # if device.get("snmpLocation"):
+        #     location = device["snmpLocation"]
+    
+            
+        site_name = transformer.site_to_site(transformer.extract_site(device.get("site")))
+        device_name=transformer.transform_name(device.get("hostname"))
         
+        #TODO: Handle stackwise when multi serial#s
+
+        serial_number=re.sub('^([^,]*),.*$','\1',device.get("serialNumber").upper() if device.get("serialNumber") else "Unknown")
+        device_type = transformer.transform_device_type(device.get("platformId"))
+        device_entity = Device(
+            name=device_name,
+            device_type=_device_type(device_type["model"]) if device_type else None,
+            manufacturer=MANUFACTURER,
+            role=_role(f"{device.get('family')} - {transformer.transform_role(device.get('role'))}"),
+            platform=_platform(transformer.transform_platform(
+                device.get("softwareType") if device.get("softwareType") else "IOS", device.get("softwareVersion")
+            )),
+            serial=serial_number,
+            site=_site(site_name),
+            # location=location,  
+            # TODO: Uncomment when Diode adds location to device
+            status=transformer.transform_status(device.get("reachabilityStatus")),
+            tags=TAGS,
+        )
+        entities.append(Entity(device=device_entity))
+        logging.debug(f"Processed device: {device.hostname}")
+
+        #TODO: Create Location, Rack, and assign device to rack when diode supports
+
+        logging.debug(f"Processing interfaces and IPs for device: {device.hostname}")
+
+        if not skip_interfaces:
+
+            # Process interfaces for the device
+            if 'Unified AP' in device.family:
+                interface_entity = Interface(
+                        name='mgmt0',
+                        mac_address=device.get("macAddress"),
+                        device=device_entity, 
+                        description=f"{device_name}: Management Interface",
+                        type="1000base-t",
+                        speed=1000000, 
+                        enabled=True,
+                        mgmt_only=True,
+                        tags=TAGS,
+                    )
+                entities.append(Entity(interface=interface_entity))
+                ip_entity = IPAddress(
+                    address=device['managementIpAddress'],
+                    interface=interface_entity,
+                    device=device_entity,
+                    description=f"{device_name}: mgmt0",
+                    tags=TAGS,
+                )
+                entities.append(Entity(ip_address=ip_entity))
+                logging.debug(f"Processed AP interface: mgmt0 / IP: {device['managementIpAddress']}")
+
+                interface_entity = Interface(
+                        name='radio0',
+                        device=device_entity, 
+                        mac_address=device.get("apEthernetMacAddress"),
+                        description=f"{device_name} Radio Interface",
+                        type='other-wireless',
+                        enabled=True,
+                        tags=TAGS,
+                    )
+                entities.append(Entity(interface=interface_entity))
+                logging.debug(f"Processed AP interface: radio0")
+            
+            else:
+                    
+                entities.extend(build_interface_entities(
+                    device.get("interfaces", []), device_entity, device_name, site_name, transformer, logging
+                ))
+
+    except Exception as device_error:
+        logging.error(
+            f"Error processing device {device.get('hostname', 'unknown')}: {device_error}"
+        )
+
+    return entities
+
+
+_worker_transformer = None
+
+def _init_transform_worker(transformer, log_level):
+    global _worker_transformer
+    _logging.basicConfig(level=log_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    _worker_transformer = transformer
+
+
+def _transform_chunk(chunk):
+    """
+    Worker process side of build_device_entities: returns, per device, its
+    serialized entities and the time.monotonic() span spent building them
+    (the clock is shared by the processes of a host). A device that fails
+    only loses its own entities.
+    """
+    results = []
+    for device, skip_interfaces in chunk:
+        started = time.monotonic()
         try:
-            # location = transformer.extract_location(device_data.get("site"))
-            # if len(location) < 1:
-            #     location = transformer.site_to_site(transformer.extract_site(device_data.get("site")))
-            # if device.get("snmpLocation"):
-            #     location = device["snmpLocation"]
+            entities = build_device_entities(device, _worker_transformer, _logging, skip_interfaces)
+            payloads = [entity.SerializeToString() for entity in entities]
+        except Exception as e:
+            _logging.error(f"Error processing device {device.get('hostname', 'unknown')}: {e}")
+            payloads = []
+        results.append((payloads, started, time.monotonic()))
+    return results
+
+
+def _iter_device_entities(devices, transformer, logging, skip_interfaces, workers):
+    """
+    Yield (device, entities, started, ended) in device order, with the
+    time.monotonic() span spent building the entities. With more than one
+    worker, devices are transformed in chunks by a pool of processes, with
+    at most two chunks per worker in flight.
+    """
+    def _skip(device):
+        # Devices unchanged since the last incremental sync were fetched
+        # without interfaces, so only their device entity is rebuilt
+        return skip_interfaces or bool(device.get("unchanged"))
+
+    if workers <= 1:
+        for device in devices:
+            started = time.monotonic()
+            entities = build_device_entities(device, transformer, logging, _skip(device))
+            yield device, entities, started, time.monotonic()
+        return
+
+    def _drain(chunk, future):
+        for device, (payloads, started, ended) in zip(chunk, future.result()):
+            yield device, [EntityMessage.FromString(payload) for payload in payloads], started, ended
+
+    logging.info(f"Transforming devices using {workers} worker processes")
+    # spawn rather than fork, the ingestion and fetch threads are running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_transform_worker,
+        initargs=(transformer, logging.getLogger().getEffectiveLevel()),
+    ) as executor:
+        in_flight = deque()
+        chunk = []
+        for device in devices:
+            chunk.append(device)
+            if len(chunk) < TRANSFORM_CHUNK_SIZE:
+                continue
+            in_flight.append((chunk, executor.submit(_transform_chunk, [(item, _skip(item)) for item in chunk])))
+            chunk = []
+            if len(in_flight) >= workers * 2:
+                yield from _drain(*in_flight.popleft())
+        if chunk:
+            in_flight.append((chunk, executor.submit(_transform_chunk, [(item, _skip(item)) for item in chunk])))
+        while in_flight:
+            yield from _drain(*in_flight.popleft())
+
+
+def prepare_data(client,devices,logging,skip_interfaces=False,sync_state=None,transformer=None,workers=1,port_index=None,checkpoint=None):
+    """
+    Transform devices into Diode entities and queue them for ingestion on
+    client, an IngestPipeline, in batches. With workers > 1 the entities
+    are built in that many processes; batches keep the device order.
+    The ports of every device sent are added to port_index (a
+    topology.PortIndex) when one is given, and devices are acknowledged in
+    checkpoint once Diode has accepted their batch.
+    """
+    
+    if transformer is None:
+        transformer = Transformer("includes/site_rules.yml","includes/skip_device_rules.yml")
+    entities = []
+    entities_bytes = 0
+    emitted_prefixes = set()
+    batch = sync_state.new_batch() if sync_state is not None else None
+    batch_devices = []
+
+    def _on_success(batch, batch_devices, run):
+        if batch is not None:
+            sync_state.commit(batch)
+        if checkpoint is not None:
+            checkpoint.acknowledge(batch_devices, run)
+
+    def _ingest(entities, batch, batch_devices):
+        # client is the background IngestPipeline; sync state and checkpoint
+        # for the batch are committed from its worker once Diode has
+        # accepted the batch
+        on_success = None
+        if batch is not None or checkpoint is not None:
+            run = checkpoint.batch_submitted() if checkpoint is not None else None
+            on_success = lambda: _on_success(batch, batch_devices, run)
+        client.submit(entities, on_success)
+
+    if skip_interfaces:
+        logging.info("Skipping Discovery of Interfaces")
         
-                
-            site_name = transformer.site_to_site(transformer.extract_site(device.get("site")))
-            device_name=transformer.transform_name(device.get("hostname"))
-            
-            #TODO: Handle stackwise when multi serial#s
-
-            serial_number=re.sub('^([^,]*),.*$','\1',device.get("serialNumber").upper() if device.get("serialNumber") else "Unknown")
-            device_entity = Device(
-                name=device_name,
-                device_type=transformer.transform_device_type(device.get("platformId")),
-                manufacturer="Cisco",
-                role=f"{device.get('family')} - {transformer.transform_role(device.get('role'))}",
-                platform=transformer.transform_platform(
-                    device.get("softwareType") if device.get("softwareType") else "IOS", device.get("softwareVersion")
-                ),
-                serial=serial_number,
-                site=site_name,
-                # location=location,  
-                # TODO: Uncomment when Diode adds location to device
-                status=transformer.transform_status(device.get("reachabilityStatus")),
-                tags=["Diode-CATC-Agent","Diode"],
-            )
-            entities.append(Entity(device=device_entity))
-            logging.debug(f"Processed device: {device.hostname}")
-
-            #TODO: Create Location, Rack, and assign device to rack when diode supports
-
-            logging.debug(f"Processing interfaces and IPs for device: {device.hostname}")
-
-            if not skip_interfaces:
-
-                # Process interfaces for the device
-                if 'Unified AP' in device.family:
-                    interface_entity = Interface(
-                            name='mgmt0',
-                            mac_address=device.get("macAddress"),
-                            device=device_entity, 
-                            description=f"{device_name}: Management Interface",
-                            type="1000base-t",
-                            speed=1000000, 
-                            enabled=True,
-                            mgmt_only=True,
-                            tags=["Diode-CATC-Agent","Diode"],
-                        )
-                    entities.append(Entity(interface=interface_entity))
-                    ip_entity = IPAddress(
-                        address=device['managementIpAddress'],
-                        interface=interface_entity,
-                        device=device_entity,
-                        description=f"{device_name}: mgmt0",
-                        tags=["Diode-CATC-Agent","Diode"],
-                    )
-                    entities.append(Entity(ip_address=ip_entity))
-                    logging.debug(f"Processed AP interface: mgmt0 / IP: {device['managementIpAddress']}")
-
-                    interface_entity = Interface(
-                            name='radio0',
-                            device=device_entity, 
-                            mac_address=device.get("apEthernetMacAddress"),
-                            description=f"{device_name} Radio Interface",
-                            type='other-wireless',
-                            enabled=True,
-                            tags=["Diode-CATC-Agent","Diode"],
-                        )
-                    entities.append(Entity(interface=interface_entity))
-                    logging.debug(f"Processed AP interface: radio0")
-                
-                else:
-                        
-                    for interface in device.get("interfaces", []):
-                        try:
-                            interface_entity = Interface(
-                                name=interface.get("portName"),
-                                mac_address=interface.get("macAddress"),
-                                device=device_entity,
-                                description=f"{device_name}: {interface.get('portName')} ({interface.get('description')})",
-                                type=transformer.infer_interface_type(
-                                    interface.get("portName"), interface.get("speed")
-                                ),
-                                speed=int(interface.get("speed", 0)),
-                                enabled=True if 'status' in interface and interface.get("status") in ["connected", "up", "reachable"] else False,
-                                mtu=int(interface.get("mtu")),
-                                tags=["Diode-CATC-Agent","Diode"],
-                            )
-                            entities.append(Entity(interface=interface_entity))
-                            #TODO: assign LAG members if port-channel
-                            
-                            logging.debug(f"Processed interface: {interface.get('portName')}")
-
-
-                            try:
-                                if interface.get('ipv4Address'):
-                                    ip_data = IPAddress(
-                                        address=transformer.get_cidr(interface.get('ipv4Address'),interface.get('ipv4Mask')),
-                                        interface=interface_entity,
-                                        device=device_entity,
-                                        description=f"{interface_entity.description}",
-                                        tags=["Diode-CATC-Agent","Diode"],
-                                    )
-                                    entities.append(Entity(ip_address=ip_data))
-
-                                    if 'Vlan' in interface.get('portName'):
-                                        prefix_entity = Prefix(
-                                            prefix=transformer.get_network_addr(interface.get('ipv4Address'),interface.get('ipv4Mask')),
-                                            site = site_name,
-                                            description = f"{interface.get('portName')}: {interface.get('description')} ({site_name})",
-                                            status='active',
-                                            tags=["Diode-CATC-Agent","Diode"],
-
-                                        )
-                                        entities.append(Entity(prefix=prefix_entity))
-                                        
-                                #TODO: Create VLAN when Diode Updated
-                            except Exception as ip_error:
-                                logging.error(f"Error processing IP: {ip_error}")
-
-                        except Exception as interface_error:
-                            logging.error(
-                                f"Error processing interface {device_name} {interface.get('portName', 'unknown')}: {interface_error}"
-                            )
-                        
-            # Ingest data into Diode
-            if len(entities) > 9000:
-                logging.info(f"Ingesting {len(entities)} entity batch device data into Diode...")
-                response = client.ingest(entities=entities)# + interface_entities)
-                if response.errors:
-                    logging.error(f"Errors during ingestion: {response.errors}")
-                else:
-                    logging.debug("Data ingested successfully into Diode.")
-                entities = []
-                
-        except Exception as device_error:
-            logging.error(
-                f"Error processing device {device.get('hostname', 'unknown')}: {device_error}"
-            )
+    for device, device_entities, started, ended in _iter_device_entities(devices, transformer, logging, skip_interfaces, workers):
+        METRICS.record_stage("transform", started, ended)
+        if port_index is not None and device_entities and device_entities[0].WhichOneof("entity") == "device":
+            # APs are linked by their uplink port, which is not one of the
+            # interfaces they are sent with
+            if 'Unified AP' not in (device.get("family") or ""):
+                collected = not skip_interfaces and not device.get("unchanged")
+                port_index.add_device(
+                    device.get("id"),
+                    device_entities[0].device.name,
+                    device_entities[0].device.site.name,
+                    [interface.get("portName") for interface in device.get("interfaces", [])] if collected else None,
+                )
+        # A subnet carried by several devices (HSRP pairs, stacks) is only
+        # sent once per run, for the first device that has it
+        unique_entities = []
+        for entity in device_entities:
+            if entity.WhichOneof("entity") == "prefix":
+                key = (entity.prefix.prefix, entity.prefix.site.name)
+                if key in emitted_prefixes:
+                    METRICS.inc("prefixes_deduplicated_total")
+                    continue
+                emitted_prefixes.add(key)
+            unique_entities.append(entity)
+        device_entities = unique_entities
+        if batch is not None:
+            device_entities = sync_state.filter_changed(device_entities, batch)
+            sync_state.stage_device(device.get("id"), device.get("lastUpdateTime"), batch)
+        # Only entities that are sent, after deduplication and change filtering
+        for entity in device_entities:
+            METRICS.inc("entities_total", {"type": entity.WhichOneof("entity")})
+        entities.extend(device_entities)
+        entities_bytes += sum(entity.ByteSize() for entity in device_entities)
+        batch_devices.append(device.get("id"))
+
+        # Ingest data into Diode once the batch reaches the pipeline's
+        # current target size in serialized bytes
+        if entities_bytes >= client.batch_bytes:
+            _ingest(entities, batch, batch_devices)
+            entities = []
+            entities_bytes = 0
+            batch = sync_state.new_batch() if sync_state is not None else None
+            batch_devices = []
 
-    logging.info(f"Ingesting {len(entities)} entity batch device data into Diode...")
-    response = client.ingest(entities=entities)# + interface_entities)
-    if response.errors:
-        logging.error(f"Errors during ingestion: {response.errors}")
-    else:
-        logging.debug("Data ingested successfully into Diode.")
+    if entities or batch is None:
+        _ingest(entities, batch, batch_devices)
+    elif batch is not None:
+        # Nothing changed in the tail batch but the device state still advances
+        run = checkpoint.batch_submitted() if checkpoint is not None else None
+        _on_success(batch, batch_devices, run)
     entities = []
 
-    return entities
\ No newline at end of file
+    return entities
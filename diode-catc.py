@@ -1,20 +1,38 @@
 import logging
 import argparse
 import os
+import time
+import signal
+import threading
 from dotenv import load_dotenv
-from catc_connector import connect_to_catc
-from catc_fetcher import get_device_data
-from data_conversion import prepare_data
+from controllers import load_controllers, merge_device_streams
+from catc_fetcher import iter_device_data
+from data_conversion import prepare_data, TAGS
+from topology import PortIndex, sync_cables, CABLES_SUPPORTED
+from site_cache import SiteCache
+from transformer import Transformer
+from sync_state import SyncState
 from netboxlabs.diode.sdk import DiodeClient
+from diode_ingest import IngestPipeline, FileSink
+from snapshot import SnapshotWriter, read_snapshot
+from checkpoint import Checkpoint
+from sharding import Shard
+from events import EventListener, subscribe_to_events
+from metrics import METRICS
 from version import __version__
 
 # Load .env file
 load_dotenv()
 
+# Devices refetched per device list request in listener mode
+EVENT_QUERY_SIZE = 50
+
 def parse_arguments():
     """
     Parse command-line arguments with environment variable defaults,
-    making all arguments effectively required.
+    making all arguments effectively required (Catalyst Center settings are
+    not needed with --replay or --controllers, nor Diode settings with
+    --output-file).
     """
     import argparse
     import os
@@ -24,33 +42,33 @@ def parse_arguments():
     parser.add_argument(
         "--diode-server",
         default=os.getenv("DIODE_SERVER"),
-        required=not os.getenv("DIODE_SERVER"),
         help="Diode server address (or set via DIODE_SERVER environment variable)"
     )
     parser.add_argument(
         "--diode-api-key",
         default=os.getenv("DIODE_API_KEY"),
-        required=not os.getenv("DIODE_API_KEY"),
         help="Diode API token (or set via DIODE_API_KEY environment variable)"
     )
     parser.add_argument(
         "--catc-host",
         default=os.getenv("CATC_HOST"),
-        required=not os.getenv("CATC_HOST"),
         help="Catalyst Center host (or set via CATC_HOST environment variable)"
     )
     parser.add_argument(
         "--catc-user",
         default=os.getenv("CATC_USER"),
-        required=not os.getenv("CATC_USER"),
         help="Catalyst Center username (or set via CATC_USER environment variable)"
     )
     parser.add_argument(
         "--catc-password",
         default=os.getenv("CATC_PASSWORD"),
-        required=not os.getenv("CATC_PASSWORD"),
         help="Catalyst Center password (or set via CATC_PASSWORD environment variable)"
     )
+    parser.add_argument(
+        "--controllers",
+        default=os.getenv("CATC_CONTROLLERS"),
+        help="YAML file listing several Catalyst Center controllers to sync concurrently, instead of --catc-host (or set via CATC_CONTROLLERS environment variable)"
+    )
     parser.add_argument(
         "--catc-verify",
         default=os.getenv("CATC_VERIFY", "true").lower() in ("true", "1", "yes"),
@@ -71,7 +89,374 @@ def parse_arguments():
         help="Skip Collecting interfaces (default: true, or set via SKIP_INTERFACES environment variable)"
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--site-filter",
+        default=os.getenv("SITE_FILTER"),
+        help="Only sync devices in this site hierarchy subtree, e.g. Global/Campus/Building 6 (or set via SITE_FILTER environment variable)"
+    )
+    parser.add_argument(
+        "--family-filter",
+        default=os.getenv("FAMILY_FILTER"),
+        type=lambda x: [value.strip() for value in x.split(",") if value.strip()],
+        help="Only sync these comma-separated device families, e.g. \"Switches and Hubs,Routers\" (or set via FAMILY_FILTER environment variable)"
+    )
+    parser.add_argument(
+        "--role-filter",
+        default=os.getenv("ROLE_FILTER"),
+        type=lambda x: [value.strip() for value in x.split(",") if value.strip()],
+        help="Only sync these comma-separated device roles, e.g. ACCESS,DISTRIBUTION (or set via ROLE_FILTER environment variable)"
+    )
+    parser.add_argument(
+        "--hostname-filter",
+        default=os.getenv("HOSTNAME_FILTER"),
+        help="Only sync devices whose hostname matches this glob, e.g. bldg6-* (or set via HOSTNAME_FILTER environment variable)"
+    )
+
+    parser.add_argument(
+        "--shard-index",
+        default=int(os.getenv("SHARD_INDEX", "0")),
+        type=int,
+        help="Index of this agent among --shard-count agents splitting the inventory; shard 0 also sends cables (default: 0, or set via SHARD_INDEX environment variable)"
+    )
+    parser.add_argument(
+        "--shard-count",
+        default=int(os.getenv("SHARD_COUNT", "1")),
+        type=int,
+        help="Number of agents each syncing a disjoint slice of the devices (default: 1, or set via SHARD_COUNT environment variable)"
+    )
+
+    parser.add_argument(
+        "--catc-workers",
+        default=int(os.getenv("CATC_WORKERS", "8")),
+        type=int,
+        help="Number of concurrent Catalyst Center requests when collecting device details (default: 8, or set via CATC_WORKERS environment variable)"
+    )
+    parser.add_argument(
+        "--catc-rate-limit",
+        default=float(os.getenv("CATC_RATE_LIMIT", "0")),
+        type=float,
+        help="Maximum Catalyst Center requests per second, 0 for no limit; concurrency also backs off on HTTP 429 (default: 0, or set via CATC_RATE_LIMIT environment variable)"
+    )
+
+    parser.add_argument(
+        "--bulk-interfaces",
+        default=os.getenv("BULK_INTERFACES", "false").lower() in ("true", "1", "yes"),
+        type=lambda x: x.lower() in ("true", "1", "yes"),
+        help="Retrieve all interfaces through the paginated bulk interface listing instead of one request per device (default: false, or set via BULK_INTERFACES environment variable)"
+    )
+
+    parser.add_argument(
+        "--topology",
+        default=os.getenv("TOPOLOGY", "false").lower() in ("true", "1", "yes"),
+        type=lambda x: x.lower() in ("true", "1", "yes"),
+        help="Fetch the physical topology and send cables between collected interfaces; needs a Diode SDK with cable support (default: false, or set via TOPOLOGY environment variable)"
+    )
+
+    parser.add_argument(
+        "--site-cache",
+        default=os.getenv("SITE_CACHE", "./site_cache.db"),
+        help="Path of the SQLite hostname prefix to site cache (default: ./site_cache.db, or set via SITE_CACHE environment variable)"
+    )
+    parser.add_argument(
+        "--site-cache-ttl",
+        default=int(os.getenv("SITE_CACHE_TTL", str(7 * 24 * 3600))),
+        type=int,
+        help="Seconds before a cached site entry expires, 0 to never expire (default: 604800, or set via SITE_CACHE_TTL environment variable)"
+    )
+    parser.add_argument(
+        "--site-cache-max-entries",
+        default=int(os.getenv("SITE_CACHE_MAX_ENTRIES", "50000")),
+        type=int,
+        help="Maximum number of site cache entries kept, 0 for no limit (default: 50000, or set via SITE_CACHE_MAX_ENTRIES environment variable)"
+    )
+
+    parser.add_argument(
+        "--incremental",
+        default=os.getenv("INCREMENTAL", "false").lower() in ("true", "1", "yes"),
+        type=lambda x: x.lower() in ("true", "1", "yes"),
+        help="Only fetch interfaces for devices changed since the last run and only send changed entities to Diode (default: false, or set via INCREMENTAL environment variable)"
+    )
+    parser.add_argument(
+        "--full",
+        default=os.getenv("FULL_SYNC", "false").lower() in ("true", "1", "yes"),
+        type=lambda x: x.lower() in ("true", "1", "yes"),
+        help="Force a complete resync in incremental mode, rebuilding the sync state (default: false, or set via FULL_SYNC environment variable)"
+    )
+    parser.add_argument(
+        "--sync-state",
+        default=os.getenv("SYNC_STATE", "./sync_state.db"),
+        help="Path of the incremental sync state database (default: ./sync_state.db, or set via SYNC_STATE environment variable)"
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        default=os.getenv("CHECKPOINT", "./checkpoint.jsonl"),
+        help="Path of the file recording fetched devices and ingested batches of the current run (default: ./checkpoint.jsonl, or set via CHECKPOINT environment variable)"
+    )
+    parser.add_argument(
+        "--resume",
+        default=os.getenv("RESUME", "false").lower() in ("true", "1", "yes"),
+        type=lambda x: x.lower() in ("true", "1", "yes"),
+        help="Continue an interrupted run from the checkpoint, skipping devices Diode already accepted (default: false, or set via RESUME environment variable)"
+    )
+
+    parser.add_argument(
+        "--max-in-flight",
+        default=int(os.getenv("MAX_IN_FLIGHT", "200")),
+        type=int,
+        help="Maximum number of devices being fetched or waiting for transformation at once (default: 200, or set via MAX_IN_FLIGHT environment variable)"
+    )
+
+    parser.add_argument(
+        "--transform-workers",
+        default=int(os.getenv("TRANSFORM_WORKERS", "1")),
+        type=int,
+        help="Number of processes building Diode entities, 1 to transform in the main process (default: 1, or set via TRANSFORM_WORKERS environment variable)"
+    )
+
+    parser.add_argument(
+        "--diode-workers",
+        default=int(os.getenv("DIODE_WORKERS", "2")),
+        type=int,
+        help="Number of background Diode ingestion workers, each with its own gRPC channel (default: 2, or set via DIODE_WORKERS environment variable)"
+    )
+    parser.add_argument(
+        "--diode-retries",
+        default=int(os.getenv("DIODE_RETRIES", "3")),
+        type=int,
+        help="Number of times a failed ingestion batch is retried with backoff (default: 3, or set via DIODE_RETRIES environment variable)"
+    )
+    parser.add_argument(
+        "--diode-max-batch-bytes",
+        default=int(os.getenv("DIODE_MAX_BATCH_BYTES", str(3 * 1024 * 1024))),
+        type=int,
+        help="Ceiling on the serialized size of one ingestion request in bytes (default: 3145728, or set via DIODE_MAX_BATCH_BYTES environment variable)"
+    )
+
+    parser.add_argument(
+        "--daemon",
+        default=os.getenv("DAEMON", "false").lower() in ("true", "1", "yes"),
+        type=lambda x: x.lower() in ("true", "1", "yes"),
+        help="Keep running and sync every --interval seconds, reusing sessions, rules and caches (default: false, or set via DAEMON environment variable)"
+    )
+    parser.add_argument(
+        "--interval",
+        default=int(os.getenv("SYNC_INTERVAL", "3600")),
+        type=int,
+        help="Seconds between the start of consecutive sync cycles in daemon mode (default: 3600, or set via SYNC_INTERVAL environment variable)"
+    )
+    parser.add_argument(
+        "--catc-token-lifetime",
+        default=int(os.getenv("CATC_TOKEN_LIFETIME", "3000")),
+        type=int,
+        help="Seconds after which the Catalyst Center access token is refreshed before a cycle (default: 3000, or set via CATC_TOKEN_LIFETIME environment variable)"
+    )
+
+    parser.add_argument(
+        "--listen-port",
+        default=int(os.getenv("WEBHOOK_PORT", "0")),
+        type=int,
+        help="Receive Catalyst Center event notifications on this port and resync only the devices they name, with a full sync every --interval seconds as reconciliation; 0 to disable (default: 0, or set via WEBHOOK_PORT environment variable)"
+    )
+    parser.add_argument(
+        "--webhook-url",
+        default=os.getenv("WEBHOOK_URL"),
+        help="URL Catalyst Center should send events to, e.g. https://agent.example.edu:9000/events; registered as a webhook destination when --webhook-events is set (or set via WEBHOOK_URL environment variable)"
+    )
+    parser.add_argument(
+        "--webhook-events",
+        default=os.getenv("WEBHOOK_EVENTS"),
+        type=lambda x: [value.strip() for value in x.split(",") if value.strip()],
+        help="Comma-separated Catalyst Center event ids to subscribe --webhook-url to, from the event catalog (or set via WEBHOOK_EVENTS environment variable)"
+    )
+    parser.add_argument(
+        "--webhook-token",
+        default=os.getenv("WEBHOOK_TOKEN"),
+        help="Shared secret Catalyst Center sends in the X-Diode-CATC-Token header; other requests are rejected (or set via WEBHOOK_TOKEN environment variable)"
+    )
+    parser.add_argument(
+        "--webhook-debounce",
+        default=float(os.getenv("WEBHOOK_DEBOUNCE", "10")),
+        type=float,
+        help="Seconds without new events before a burst of events is synced (default: 10, or set via WEBHOOK_DEBOUNCE environment variable)"
+    )
+
+    parser.add_argument(
+        "--metrics-textfile",
+        default=os.getenv("METRICS_TEXTFILE"),
+        help="Write Prometheus metrics to this file after every sync cycle, for the node_exporter textfile collector (or set via METRICS_TEXTFILE environment variable)"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        default=int(os.getenv("METRICS_PORT", "0")),
+        type=int,
+        help="Serve Prometheus metrics on this port at /metrics, 0 to disable (default: 0, or set via METRICS_PORT environment variable)"
+    )
+    parser.add_argument(
+        "--run-summary",
+        default=os.getenv("RUN_SUMMARY"),
+        help="Write a JSON summary of stage timings, API calls and ingestion after every sync cycle (or set via RUN_SUMMARY environment variable)"
+    )
+
+    parser.add_argument(
+        "--record",
+        default=os.getenv("RECORD_SNAPSHOT"),
+        help="Write the raw Catalyst Center sites, devices and interfaces of each sync to this gzip NDJSON snapshot (or set via RECORD_SNAPSHOT environment variable)"
+    )
+    parser.add_argument(
+        "--replay",
+        default=os.getenv("REPLAY_SNAPSHOT"),
+        help="Transform and ingest a snapshot written by --record instead of contacting Catalyst Center (or set via REPLAY_SNAPSHOT environment variable)"
+    )
+    parser.add_argument(
+        "--output-file",
+        default=os.getenv("OUTPUT_FILE"),
+        help="Write entities as NDJSON to this file (gzip compressed if it ends in .gz) instead of sending them to Diode (or set via OUTPUT_FILE environment variable)"
+    )
+
+    args = parser.parse_args()
+
+    # Catalyst Center is not needed to replay a snapshot, nor Diode to write entities to a file
+    required = []
+    if not args.replay and not args.controllers:
+        required += [("--catc-host", args.catc_host), ("--catc-user", args.catc_user), ("--catc-password", args.catc_password)]
+    if not args.output_file:
+        required += [("--diode-server", args.diode_server), ("--diode-api-key", args.diode_api_key)]
+    missing = [option for option, value in required if not value]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be between 0 and --shard-count - 1")
+    if args.topology and not CABLES_SUPPORTED:
+        # Without it the port index and the site sweep for it would be wasted
+        parser.error("--topology needs a Diode SDK with cable support, the installed netboxlabs-diode-sdk has no Cable")
+    if args.listen_port and args.replay:
+        parser.error("--listen-port cannot be used with --replay")
+    if args.webhook_events and not args.webhook_url:
+        parser.error("--webhook-events needs --webhook-url")
+    return args
+
+
+def _export_metrics(args):
+    try:
+        if args.metrics_textfile:
+            METRICS.write_prometheus(args.metrics_textfile)
+        if args.run_summary:
+            METRICS.write_summary(args.run_summary)
+    except OSError as e:
+        logging.error(f"Failed to write metrics: {e}")
+
+
+def _connect_diode(args):
+    """
+    Return the entity sink: a file with --output-file, otherwise a Diode
+    ingestion pipeline with one client (gRPC channel) per worker.
+    """
+    if args.output_file:
+        logging.info(f"Writing entities to {args.output_file} instead of Diode.")
+        return FileSink(args.output_file, args.diode_max_batch_bytes)
+
+    logging.debug(f"Attempting to connect to Diode at {args.diode_server}...")
+    ingestor = IngestPipeline(
+        lambda: DiodeClient(
+            target=f"grpc://{args.diode_server}",
+            app_name="diode-catc",
+            app_version=__version__,
+        ),
+        args.diode_workers,
+        args.diode_retries,
+        max_batch_bytes=args.diode_max_batch_bytes,
+    )
+    logging.info("Successfully connected to Diode.")
+    return ingestor
+
+
+def _filters(args):
+    return {
+        "site": args.site_filter,
+        "family": args.family_filter,
+        "role": args.role_filter,
+        "hostname": args.hostname_filter,
+    }
+
+
+def sync_cycle(args, controllers, ingestor, transformer, site_cache, sync_state, stop_event=None, checkpoint=None, shard=None):
+    """
+    Run one Catalyst Center to Diode sync with already connected clients.
+    Several controllers are fetched concurrently into the same
+    transformation and ingestion. With a shard only its slice of the
+    devices is synced, and only the designated shard sends cables.
+    """
+    # Stream devices from Catalyst Center straight into transformation
+    # and ingestion as they are collected
+    logging.info("Retrieving device data from Catalyst Center and transforming it into Diode-compatible format...")
+    recorder = SnapshotWriter(args.record, __version__) if args.record else None
+    filters = _filters(args)
+    if checkpoint is not None:
+        checkpoint.start()
+    # Cables are joined to the interfaces sent this cycle
+    port_index = None
+    if args.topology and not args.skip_interfaces:
+        if shard is None or shard.designated:
+            port_index = PortIndex()
+        else:
+            logging.info(f"Shard {shard} leaves the topology to shard 0")
+    try:
+        streams = [
+            (controller.name, iter_device_data(
+                controller.catc, logging, args.skip_interfaces, controller.workers, args.bulk_interfaces,
+                site_cache, sync_state, args.max_in_flight, transformer, stop_event, recorder, filters, checkpoint,
+                shard, port_index,
+            ))
+            for controller in controllers
+        ]
+        failed = []
+        devices = streams[0][1] if len(streams) == 1 else merge_device_streams(streams, logging, args.max_in_flight, failed)
+        with METRICS.stage("cycle"):
+            prepare_data(
+                ingestor, devices, logging, args.skip_interfaces, sync_state, transformer, args.transform_workers,
+                port_index, checkpoint,
+            )
+        if failed:
+            # Leave the checkpoint unfinished so --resume picks up the missing devices
+            raise RuntimeError(f"Collection from Catalyst Center {', '.join(sorted(failed))} failed partway")
+        if checkpoint is not None and not (stop_event is not None and stop_event.is_set()):
+            checkpoint.finish()
+    except BaseException:
+        if recorder is not None:
+            recorder.close(commit=False)
+        raise
+    if recorder is not None:
+        recorder.close()
+        logging.info(f"Recorded {recorder.devices} devices and {recorder.sites} sites to {args.record}")
+
+    if port_index is not None:
+        for controller in controllers:
+            sync_cables(controller.catc, ingestor, port_index, logging, sync_state, TAGS)
+
+
+def sync_devices(args, controllers, ingestor, transformer, site_cache, devices, shard=None):
+    """
+    Refetch and send only the devices named by Catalyst Center events,
+    given as {"id": [...], "ip": [...]}, through the same collection and
+    prepare_data path as a full sync. Every controller is asked, as an
+    event does not say which cluster it came from.
+    """
+    def _streams():
+        for kind, values in devices.items():
+            # Keep the device list query string short
+            for start in range(0, len(values), EVENT_QUERY_SIZE):
+                for controller in controllers:
+                    yield from iter_device_data(
+                        controller.catc, logging, args.skip_interfaces, controller.workers, False, site_cache, None,
+                        args.max_in_flight, transformer, filters={kind: values[start:start + EVENT_QUERY_SIZE]}, shard=shard,
+                    )
+
+    count = sum(len(values) for values in devices.values())
+    logging.info(f"Syncing {count} devices named by Catalyst Center events")
+    METRICS.inc("webhook_devices_total", amount=count)
+    with METRICS.stage("event_sync"):
+        prepare_data(ingestor, _streams(), logging, args.skip_interfaces, None, transformer, 1)
 
 
 def main():
@@ -86,37 +471,135 @@ def main():
 
     logging.info(f"Running Catalyst Center (CATC) to Diode Agent version {__version__}")
 
+    # Stop after the current cycle (or between cycles) on SIGTERM/SIGINT
+    stop_event = threading.Event()
+
+    def _request_stop(signum, frame):
+        logging.info(f"Received signal {signum}, shutting down after the current cycle...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    if args.metrics_port:
+        METRICS.start_http_server(args.metrics_port)
+        logging.info(f"Serving Prometheus metrics on port {args.metrics_port}")
+
+    transformer = Transformer("includes/site_rules.yml","includes/skip_device_rules.yml")
+    # A replay resolves no sites, so it leaves the cache file alone
+    site_cache = SiteCache(args.site_cache, args.site_cache_ttl, args.site_cache_max_entries) if not args.replay else None
+    sync_state = SyncState(args.sync_state, args.full) if args.incremental and not args.replay else None
+    shard = Shard(args.shard_index, args.shard_count) if args.shard_count > 1 else None
+    ingestor = None
+    checkpoint = None
+    listener = None
+    if args.record and sync_state is not None and not args.full:
+        logging.warning("Recording an incremental sync: devices unchanged since the last run are recorded without interfaces")
+
     try:
-        # Connect to Catalyst Center
-        logging.debug(f"Attempting to connect to Catalyst Center at {args.catc_host}...")
-        catc = connect_to_catc(args.catc_host, args.catc_user, args.catc_password, args.catc_verify)
-        logging.info("Successfully connected to Catalyst Center.")
-
-        # Connect to Diode
-        logging.debug(f"Attempting to connect to Diode at {args.diode_server}...")
-        with DiodeClient(
-            target=f"grpc://{args.diode_server}",
-            app_name="diode-catc",
-            app_version=__version__,
-        ) as client:
-            
-            logging.info("Successfully connected to Diode.")
+        if args.replay:
+            # Transform a recorded snapshot without contacting Catalyst Center
+            ingestor = _connect_diode(args)
+            with METRICS.stage("cycle"):
+                prepare_data(
+                    ingestor, read_snapshot(args.replay, logging), logging, args.skip_interfaces, None, transformer,
+                    args.transform_workers,
+                )
+            return
+
+        controllers = load_controllers(args)
+        scope = {"controllers": [controller.host for controller in controllers], "filters": _filters(args)}
+        if shard is not None:
+            scope["shard"] = str(shard)
+        checkpoint = Checkpoint(args.checkpoint, args.resume, scope)
+        for controller in controllers:
+            controller.ensure_session(args.catc_token_lifetime)
+
+        ingestor = _connect_diode(args)
+
+        if args.listen_port:
+            # Listener mode keeps running: events between full syncs, which
+            # become the periodic reconciliation
+            args.daemon = True
+            listener = EventListener(args.listen_port, args.webhook_token, args.webhook_debounce)
+            listener.start()
+            logging.info(f"Listening for Catalyst Center events on port {args.listen_port}")
+            if args.webhook_events:
+                for controller in controllers:
+                    if controller.catc is None:
+                        continue
+                    try:
+                        subscribe_to_events(controller.catc, logging, args.webhook_url, args.webhook_events, args.webhook_token)
+                    except Exception as e:
+                        logging.error(f"Failed to subscribe to events of Catalyst Center {controller.name}: {e}")
+            else:
+                logging.info("No --webhook-events given, the event subscription must be set up in Catalyst Center")
 
-            # Fetch data from Catalyst Center
-            logging.info("Retrieving device data from Catalyst Center...")
-            devices = get_device_data(catc,logging, args.skip_interfaces)
-            logging.info(f"Retrieved {len(devices)} devices.")
+        while True:
+            cycle_start = time.monotonic()
+            # Reconnect controllers that were unreachable and refresh old tokens
+            connected = [controller for controller in controllers if controller.ensure_session(args.catc_token_lifetime)]
 
-            # Prepare data into Diode-compatible entities
-            logging.info("Transforming device data into Diode-compatible format...")
-            prepare_data(client, devices, logging, args.skip_interfaces)
+            try:
+                if not connected:
+                    raise ConnectionError("No Catalyst Center controller could be reached")
+                if listener is not None:
+                    # Events queued so far are covered by the full sync
+                    listener.clear()
+                sync_cycle(args, connected, ingestor, transformer, site_cache, sync_state, stop_event, checkpoint, shard)
+            except Exception as e:
+                if not args.daemon:
+                    raise
+                logging.error(f"An error occurred during the sync cycle: {e}")
+            finally:
+                _export_metrics(args)
 
-            #TODO: get topology and build interconnections
+            if not args.daemon or stop_event.is_set():
+                break
+            elapsed = time.monotonic() - cycle_start
+            logging.info(f"Sync cycle finished in {elapsed:.0f}s, next cycle in {max(0, args.interval - elapsed):.0f}s")
+            if listener is None:
+                if stop_event.wait(max(0, args.interval - elapsed)):
+                    break
+            else:
+                # Sync the devices named by events until the next reconciliation
+                while not stop_event.is_set():
+                    remaining = cycle_start + args.interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    devices = listener.wait(remaining, stop_event)
+                    if devices is None:
+                        continue
+                    connected = [controller for controller in controllers if controller.ensure_session(args.catc_token_lifetime)]
+                    try:
+                        sync_devices(args, connected, ingestor, transformer, site_cache, devices, shard)
+                    except Exception as e:
+                        logging.error(f"An error occurred syncing devices from events: {e}")
+                    finally:
+                        _export_metrics(args)
+                if stop_event.is_set():
+                    break
 
+            # The summary, stage timings and gauges describe one cycle;
+            # counters stay cumulative for the life of the process
+            METRICS.reset_run()
 
     except Exception as e:
         logging.error(f"An error occurred during the process: {e}")
     finally:
+        if listener is not None:
+            listener.stop()
+        # Flush queued batches before the sync state they commit is closed
+        if ingestor is not None:
+            ingestor.close()
+            # Batches still in flight at the end of the last cycle are now done
+            _export_metrics(args)
+        if checkpoint is not None:
+            checkpoint.close()
+        if site_cache is not None:
+            site_cache.close()
+        if sync_state is not None:
+            sync_state.close()
         logging.info("Process completed.")
 
 if __name__ == "__main__":
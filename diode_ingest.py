@@ -0,0 +1,211 @@
+import json
+import gzip
+import time
+import grpc
+import queue
+import logging
+import threading
+from google.protobuf.json_format import MessageToDict
+from metrics import METRICS
+
+# gRPC's default maximum receive message size is 4 MiB
+MAX_BATCH_BYTES = 3 * 1024 * 1024
+MIN_BATCH_BYTES = 64 * 1024
+TARGET_LATENCY = 5.0
+
+# Status codes that mean the batch was too large for the server to handle
+SIZE_STATUS_CODES = (grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.DEADLINE_EXCEEDED)
+
+class IngestPipeline:
+    def __init__(self, client_factory, workers=1, retries=3, backoff=1.0, queue_size=None,
+                 max_batch_bytes=MAX_BATCH_BYTES, target_latency=TARGET_LATENCY):
+        """
+        Background Diode ingestion. Batches handed to submit() are queued and
+        sent by worker threads, each with its own client (and gRPC channel)
+        from client_factory. A batch that raises is retried with exponential
+        backoff; errors returned by Diode are reported per batch.
+
+        Producers should cut batches at batch_bytes serialized bytes. The
+        target grows while ingest calls finish within target_latency and
+        shrinks when they are slow or rejected as too large, never exceeding
+        max_batch_bytes. Batches over the ceiling, or rejected for their
+        size, are split in half and sent as two requests.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_batch_bytes = max_batch_bytes
+        self.target_latency = target_latency
+        self.min_batch_bytes = min(MIN_BATCH_BYTES, max_batch_bytes)
+        self.batch_bytes = max(self.min_batch_bytes, max_batch_bytes // 2)
+        self.batches = 0
+        self.batches_ok = 0
+        self.batches_failed = 0
+        self.entities = 0
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size or max(1, workers) * 2)
+        self._workers = []
+        for index in range(max(1, workers)):
+            worker = threading.Thread(
+                target=self._run, args=(client_factory(),), name=f"diode-ingest-{index}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+        logging.info(f"Started {len(self._workers)} Diode ingestion worker(s)")
+
+    def submit(self, entities, on_success=None):
+        """
+        Queue a batch for ingestion, blocking while the queue is full.
+        on_success is called from the worker once Diode accepts the batch.
+        """
+        with self._stats_lock:
+            self.batches += 1
+            batch_number = self.batches
+        logging.info(f"Queueing batch #{batch_number} of {len(entities)} entities for ingestion into Diode...")
+        self._queue.put((batch_number, entities, on_success))
+
+    def _run(self, client):
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+                    self._ingest(client, *item)
+                finally:
+                    self._queue.task_done()
+        finally:
+            client.close()
+
+    def _ingest(self, client, batch_number, entities, on_success):
+        started = time.monotonic()
+        sent = self._send(client, batch_number, entities)
+        ended = time.monotonic()
+        METRICS.observe("ingest_batch_seconds", ended - started)
+        METRICS.record_stage("ingest", started, ended)
+        if not sent:
+            METRICS.inc("ingest_batches_total", {"status": "failed"})
+            with self._stats_lock:
+                self.batches_failed += 1
+            return
+
+        METRICS.inc("ingest_batches_total", {"status": "ok"})
+        METRICS.inc("ingested_entities_total", amount=len(entities))
+
+        logging.debug(f"Batch #{batch_number}: data ingested successfully into Diode.")
+        with self._stats_lock:
+            self.batches_ok += 1
+            self.entities += len(entities)
+        if on_success is not None:
+            try:
+                on_success()
+            except Exception as e:
+                logging.error(f"Batch #{batch_number}: post-ingest callback failed: {e}")
+
+    def _send(self, client, batch_number, entities):
+        """
+        Send entities as one request, or as several if they are too large.
+        Returns True when every part was accepted.
+        """
+        size = sum(entity.ByteSize() for entity in entities)
+        if size > self.max_batch_bytes and len(entities) > 1:
+            logging.debug(f"Batch #{batch_number}: {size} bytes is over the {self.max_batch_bytes} byte ceiling, splitting")
+            return self._send_split(client, batch_number, entities)
+
+        for attempt in range(self.retries + 1):
+            try:
+                started = time.monotonic()
+                response = client.ingest(entities=entities)
+                latency = time.monotonic() - started
+                logging.debug(f"Batch #{batch_number}: ingested {len(entities)} entities ({size} bytes) in {latency:.2f}s")
+                METRICS.observe("ingest_request_seconds", latency)
+                METRICS.inc("ingest_request_bytes_total", amount=size)
+                self._adjust(latency)
+                break
+            except Exception as e:
+                METRICS.inc("ingest_request_errors_total")
+                if _is_size_error(e) and len(entities) > 1:
+                    self._shrink()
+                    logging.warning(f"Batch #{batch_number}: rejected as too large ({e}), splitting")
+                    return self._send_split(client, batch_number, entities)
+                if attempt == self.retries:
+                    logging.error(f"Batch #{batch_number}: ingestion failed after {attempt + 1} attempts: {e}")
+                    return False
+                delay = self.backoff * (2 ** attempt)
+                logging.warning(f"Batch #{batch_number}: ingestion failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        if response.errors:
+            logging.error(f"Batch #{batch_number}: errors during ingestion: {response.errors}")
+            return False
+        return True
+
+    def _send_split(self, client, batch_number, entities):
+        middle = len(entities) // 2
+        first = self._send(client, batch_number, entities[:middle])
+        second = self._send(client, batch_number, entities[middle:])
+        return first and second
+
+    def _adjust(self, latency):
+        with self._stats_lock:
+            if latency > self.target_latency:
+                self.batch_bytes = max(self.min_batch_bytes, int(self.batch_bytes * 0.75))
+            else:
+                self.batch_bytes = min(self.max_batch_bytes, int(self.batch_bytes * 1.1))
+
+    def _shrink(self):
+        with self._stats_lock:
+            self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+
+    def close(self):
+        """
+        Flush every queued batch, stop the workers and wait for them.
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        logging.info(
+            f"Diode ingestion finished: {self.batches_ok}/{self.batches} batches ({self.entities} entities) ingested, "
+            f"{self.batches_failed} failed"
+        )
+
+
+class FileSink:
+    def __init__(self, path, max_batch_bytes=MAX_BATCH_BYTES):
+        """
+        Stand-in for IngestPipeline that writes entities as NDJSON (one JSON
+        object per entity, gzip compressed if path ends in .gz) instead of
+        sending them to Diode. Used to diff the output of rule or
+        transformer changes against a replayed snapshot.
+        """
+        self.path = path
+        self.batch_bytes = max_batch_bytes
+        self.batches = 0
+        self.entities = 0
+        self._file = gzip.open(path, "wt", encoding="utf-8") if path.endswith(".gz") else open(path, "w")
+
+    def submit(self, entities, on_success=None):
+        self.batches += 1
+        for entity in entities:
+            self._file.write(json.dumps(MessageToDict(entity), sort_keys=True))
+            self._file.write("\n")
+        self.entities += len(entities)
+        METRICS.inc("ingest_batches_total", {"status": "ok"})
+        METRICS.inc("ingested_entities_total", amount=len(entities))
+        if on_success is not None:
+            on_success()
+
+    def close(self):
+        self._file.close()
+        logging.info(f"Wrote {self.entities} entities in {self.batches} batches to {self.path}")
+
+
+def _is_size_error(error):
+    """
+    True for gRPC errors caused by the size of the request rather than the
+    state of the server. DiodeClientError carries the code as status_code.
+    """
+    code = getattr(error, "status_code", None)
+    if code is None and isinstance(error, grpc.RpcError) and callable(getattr(error, "code", None)):
+        code = error.code()
+    return code in SIZE_STATUS_CODES
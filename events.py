@@ -0,0 +1,215 @@
+import hmac
+import json
+import time
+import threading
+import ipaddress
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from metrics import METRICS
+
+# Name of the webhook destination and event subscription in Catalyst Center
+SUBSCRIPTION_NAME = "diode-catc"
+# Header carrying the shared secret Catalyst Center sends with every event
+TOKEN_HEADER = "X-Diode-CATC-Token"
+# Largest notification body accepted
+MAX_BODY_BYTES = 1024 * 1024
+
+def device_keys(event):
+    """
+    Return the ("id", device uuid) or ("ip", management address) naming the
+    device a Catalyst Center event notification is about, or None.
+    """
+    network = event.get("network") if isinstance(event.get("network"), dict) else {}
+    device_id = network.get("deviceId") or event.get("deviceId")
+    if device_id:
+        return ("id", str(device_id))
+    details = event.get("details") if isinstance(event.get("details"), dict) else {}
+    address = details.get("Device") or details.get("deviceIp") or event.get("deviceIp")
+    try:
+        return ("ip", str(ipaddress.ip_address(address)))
+    except ValueError:
+        return None
+
+
+class EventListener:
+    def __init__(self, port, token=None, debounce=10.0, max_delay=60.0, host="0.0.0.0", path="/events"):
+        """
+        HTTP receiver for Catalyst Center webhook notifications. Events are
+        reduced to the devices they name and coalesced: a burst is handed
+        out once no new event arrived for debounce seconds, or max_delay
+        seconds after its first event, so a device flapping repeatedly is
+        refetched once. With a token, requests without it in the
+        X-Diode-CATC-Token header are rejected.
+        """
+        self.token = token
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.path = path
+        self._pending = set()
+        self._first = None
+        self._last = None
+        self._condition = threading.Condition()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="webhook-listener", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def receive(self, payload):
+        """
+        Queue the devices of a notification body, one event or a list.
+        """
+        events = payload if isinstance(payload, list) else [payload]
+        keys = []
+        for event in events:
+            key = device_keys(event) if isinstance(event, dict) else None
+            if key is None:
+                METRICS.inc("webhook_events_total", {"result": "ignored"})
+                continue
+            METRICS.inc("webhook_events_total", {"result": "queued"})
+            keys.append(key)
+        if keys:
+            now = time.monotonic()
+            with self._condition:
+                self._pending.update(keys)
+                self._first = self._first or now
+                self._last = now
+                self._condition.notify_all()
+        return len(keys)
+
+    def clear(self):
+        """
+        Drop queued devices, e.g. when a full sync is about to cover them.
+        """
+        with self._condition:
+            self._pending = set()
+            self._first = None
+            self._last = None
+
+    def wait(self, timeout, stop_event=None):
+        """
+        Block until a burst of events has settled and return its devices as
+        {"id": [...], "ip": [...]}, or None when timeout seconds pass (or
+        stop_event is set) first.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                if self._pending and (now - self._last >= self.debounce or now - self._first >= self.max_delay):
+                    devices = {"id": [], "ip": []}
+                    for kind, value in sorted(self._pending):
+                        devices[kind].append(value)
+                    self._pending = set()
+                    self._first = None
+                    self._last = None
+                    return devices
+                if now >= deadline:
+                    return None
+                wake = deadline
+                if self._pending:
+                    wake = min(wake, self._last + self.debounce, self._first + self.max_delay)
+                # Wake at least every second to notice stop_event
+                self._condition.wait(min(1.0, max(0.0, wake - now)))
+
+    def _make_handler(self):
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, message):
+                body = json.dumps({"message": message}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _receive(self):
+                if self.path.split("?")[0] != listener.path:
+                    return self._reply(404, "not found")
+                if listener.token and not hmac.compare_digest(
+                    self.headers.get(TOKEN_HEADER, "").encode(), listener.token.encode()
+                ):
+                    METRICS.inc("webhook_events_total", {"result": "unauthorized"})
+                    return self._reply(401, "unauthorized")
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    return self._reply(400, "invalid Content-Length")
+                if length < 0:
+                    return self._reply(400, "invalid Content-Length")
+                if length > MAX_BODY_BYTES:
+                    return self._reply(413, "too large")
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"null")
+                except ValueError:
+                    return self._reply(400, "invalid JSON")
+                queued = listener.receive(payload)
+                return self._reply(202, f"queued {queued} devices")
+
+            def do_POST(self):
+                self._receive()
+
+            def do_PUT(self):
+                self._receive()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def subscribe_to_events(catc, logging, url, event_ids, token=None):
+    """
+    Register url as a Catalyst Center webhook destination and subscribe it
+    to event_ids, reusing the destination and subscription of a previous
+    run (matched by name) so restarts do not pile up duplicates.
+    """
+    # The SDK type checks the headers argument as a dict, the API expects a list
+    payload = {"headers": [{"name": TOKEN_HEADER, "value": token, "encrypt": True}]} if token else None
+    destination = _find_destination(catc)
+    if destination is None:
+        catc.event_management.create_webhook_destination(
+            name=SUBSCRIPTION_NAME, description="Diode Catalyst Center agent device events",
+            url=url, method="POST", trustCert=False, payload=payload,
+        )
+        destination = _find_destination(catc)
+        if destination is None:
+            raise RuntimeError(f"Webhook destination {SUBSCRIPTION_NAME} was not created")
+        logging.info(f"Created Catalyst Center webhook destination {SUBSCRIPTION_NAME} for {url}")
+    elif destination.get("url") != url:
+        catc.event_management.update_webhook_destination(
+            webhookId=destination["webhookId"], name=SUBSCRIPTION_NAME,
+            description="Diode Catalyst Center agent device events",
+            url=url, method="POST", trustCert=False, payload=payload,
+        )
+        logging.info(f"Updated Catalyst Center webhook destination {SUBSCRIPTION_NAME} to {url}")
+
+    subscriptions = catc.event_management.get_rest_webhook_event_subscriptions(name=SUBSCRIPTION_NAME)
+    if isinstance(subscriptions, list) and subscriptions:
+        logging.info(f"Catalyst Center event subscription {SUBSCRIPTION_NAME} already exists")
+        return
+    catc.event_management.create_rest_webhook_event_subscription(payload=[{
+        "name": SUBSCRIPTION_NAME,
+        "description": "Device and inventory changes for the Diode Catalyst Center agent",
+        "version": "1.0",
+        "filter": {"eventIds": list(event_ids)},
+        "subscriptionEndpoints": [{
+            "instanceId": destination["webhookId"],
+            "subscriptionDetails": {"connectorType": "REST"},
+        }],
+    }])
+    logging.info(f"Subscribed {url} to Catalyst Center events {', '.join(event_ids)}")
+
+
+def _find_destination(catc):
+    response = catc.event_management.get_webhook_destination()
+    for destination in response.get("statusMessage") or []:
+        if destination.get("name") == SUBSCRIPTION_NAME:
+            return destination
+    return None
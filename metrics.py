@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PREFIX = "diode_catc"
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class RunMetrics:
+    def __init__(self):
+        """
+        In-process registry of counters, gauges, latency histograms and stage
+        timings for a run. Rendered in the Prometheus text format or as a
+        JSON summary. Safe to record into from worker threads.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+        self.reset_run()
+
+    def reset_run(self):
+        """
+        Start a new run: stage timings and gauges describe one sync cycle,
+        while counters and histograms stay cumulative for the process.
+        """
+        with self._lock:
+            self.started = time.time()
+            self._gauges = {}
+            self._stages = {}
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+
+    def record_stage(self, stage, started, ended):
+        """
+        Add one span of work (time.monotonic() values) to the named stage.
+        Spans from concurrent workers overlap, so the stage keeps both its
+        wall time, the union of its spans, and its busy time, their sum.
+        """
+        with self._lock:
+            record = self._stages.get(stage)
+            if record is None:
+                record = self._stages[stage] = {"busy": 0.0, "runs": 0, "spans": []}
+            record["busy"] += ended - started
+            record["runs"] += 1
+            _merge_span(record["spans"], started, ended)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block of work and add it to the named stage.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(name, started, time.monotonic())
+
+    def _stage_totals(self):
+        # Called with the lock held: stage -> (wall seconds, busy seconds, runs)
+        return {
+            stage: (sum(end - start for start, end in record["spans"]), record["busy"], record["runs"])
+            for stage, record in sorted(self._stages.items())
+        }
+
+    def render_prometheus(self):
+        with self._lock:
+            stages = self._stage_totals()
+            lines = [
+                f"# TYPE {PREFIX}_stage_seconds gauge",
+                *(f'{PREFIX}_stage_seconds{{stage="{stage}"}} {wall:.6f}' for stage, (wall, _, _) in stages.items()),
+                f"# TYPE {PREFIX}_stage_busy_seconds gauge",
+                *(f'{PREFIX}_stage_busy_seconds{{stage="{stage}"}} {busy:.6f}' for stage, (_, busy, _) in stages.items()),
+                f"# TYPE {PREFIX}_stage_runs gauge",
+                *(f'{PREFIX}_stage_runs{{stage="{stage}"}} {runs}' for stage, (_, _, runs) in stages.items()),
+            ]
+            typed = set()
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                    lines.append(f"{PREFIX}_{name}{_render_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{PREFIX}_{name}_bucket{_render_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{PREFIX}_{name}_bucket{_render_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{PREFIX}_{name}_sum{_render_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{PREFIX}_{name}_count{_render_labels(labels)} {histogram['count']}")
+            lines.append(f"{PREFIX}_run_start_timestamp_seconds {self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration_seconds": round(time.time() - self.started, 3),
+                "stages": {
+                    stage: {"seconds": round(wall, 3), "busy_seconds": round(busy, 3), "runs": runs}
+                    for stage, (wall, busy, runs) in self._stage_totals().items()
+                },
+                "counters": {_summary_key(name, labels): value for (name, labels), value in self._counters.items()},
+                "gauges": {_summary_key(name, labels): value for (name, labels), value in self._gauges.items()},
+                "latency": {
+                    _summary_key(name, labels): {
+                        "count": histogram["count"],
+                        "mean_seconds": round(histogram["sum"] / histogram["count"], 4) if histogram["count"] else 0.0,
+                    }
+                    for (name, labels), histogram in self._histograms.items()
+                },
+            }
+
+    def write_prometheus(self, path):
+        """
+        Atomically write the metrics for the node_exporter textfile collector.
+        """
+        _atomic_write(path, self.render_prometheus())
+
+    def write_summary(self, path):
+        _atomic_write(path, json.dumps(self.summary(), indent=2))
+
+    def start_http_server(self, port, host="0.0.0.0"):
+        """
+        Serve the metrics at /metrics from a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+class InstrumentedClient:
+    def __init__(self, client, metrics, prefix=""):
+        """
+        Wrap a Catalyst Center SDK client so every API call is counted and
+        timed per endpoint (e.g. devices.get_device_list).
+        """
+        self._client = client
+        self._metrics = metrics
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        endpoint = f"{self._prefix}{name}"
+        if callable(attribute):
+            def _call(*args, **kwargs):
+                started = time.monotonic()
+                try:
+                    return attribute(*args, **kwargs)
+                except Exception:
+                    self._metrics.inc("catc_request_errors_total", {"endpoint": endpoint})
+                    raise
+                finally:
+                    self._metrics.inc("catc_requests_total", {"endpoint": endpoint})
+                    self._metrics.observe("catc_request_seconds", time.monotonic() - started, {"endpoint": endpoint})
+            return _call
+        if isinstance(attribute, (str, int, float, bool, type(None))):
+            return attribute
+        return InstrumentedClient(attribute, self._metrics, f"{endpoint}.")
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _render_labels(labels):
+    if not labels:
+        return ""
+    rendered = ",".join(f'{key}="{str(value)}"' for key, value in labels)
+    return "{" + rendered + "}"
+
+
+def _merge_span(spans, start, end):
+    """
+    Merge [start, end] into spans, a sorted list of disjoint (start, end)
+    tuples. Spans are reported roughly in time order, so the overlapping
+    ones are found from the end of the list.
+    """
+    index = len(spans)
+    while index and spans[index - 1][0] > end:
+        index -= 1
+    first = index
+    while first and spans[first - 1][1] >= start:
+        first -= 1
+        start = min(start, spans[first][0])
+        end = max(end, spans[first][1])
+    spans[first:index] = [(start, end)]
+
+
+def _summary_key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+
+def _atomic_write(path, content):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+# Shared registry for the whole process
+METRICS = RunMetrics()
@@ -0,0 +1,168 @@
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import METRICS
+
+# Responses that mean "slow down" rather than "this request is wrong"
+THROTTLE_STATUS_CODES = (429, 503)
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """
+        Allow on average rate requests per second with bursts of up to burst.
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    def __init__(self, maximum, minimum=1, target_latency=2.0):
+        """
+        Concurrency limit that adapts to the controller: it is halved on every
+        throttled response, lowered by one on slow responses, and raised by
+        one after a window of fast successful responses, between minimum and
+        maximum concurrent requests.
+        """
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.target_latency = target_latency
+        self.limit = self.maximum
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+        METRICS.set_gauge("catc_concurrency_limit", self.limit)
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def on_success(self, latency):
+        with self._condition:
+            if latency > self.target_latency:
+                self._set_limit(self.limit - 1)
+                return
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._successes = 0
+                self._set_limit(self.limit + 1)
+
+    def on_throttle(self):
+        with self._condition:
+            self._set_limit(self.limit // 2)
+
+    def _set_limit(self, limit):
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit != self.limit:
+            logging.debug(f"Catalyst Center concurrency limit {self.limit} -> {limit}")
+            self.limit = limit
+            self._successes = 0
+            METRICS.set_gauge("catc_concurrency_limit", limit)
+            self._condition.notify_all()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, limiter, bucket=None, max_throttle_retries=5, backoff=1.0, **kwargs):
+        """
+        requests transport adapter that gates every request through an
+        AdaptiveLimiter and an optional TokenBucket, and retries throttled
+        (429/503) responses after their Retry-After delay, or an exponential
+        backoff when the controller does not send one.
+        """
+        self.limiter = limiter
+        self.bucket = bucket
+        self.max_throttle_retries = max_throttle_retries
+        self.backoff = backoff
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.max_throttle_retries + 1):
+            if self.bucket is not None:
+                self.bucket.acquire()
+            self.limiter.acquire()
+            try:
+                started = time.monotonic()
+                response = super().send(request, **kwargs)
+                latency = time.monotonic() - started
+            finally:
+                self.limiter.release()
+
+            if response.status_code not in THROTTLE_STATUS_CODES or attempt == self.max_throttle_retries:
+                if response.status_code not in THROTTLE_STATUS_CODES:
+                    self.limiter.on_success(latency)
+                return response
+
+            self.limiter.on_throttle()
+            METRICS.inc("catc_throttled_total", {"status": response.status_code})
+            delay = _retry_after(response) or self.backoff * (2 ** attempt)
+            logging.warning(
+                f"Catalyst Center throttled {request.method} {request.path_url} ({response.status_code}), "
+                f"retrying in {delay:.1f}s with concurrency {self.limiter.limit}"
+            )
+            response.close()
+            time.sleep(delay)
+        return response
+
+
+def tune_session(session, workers, rate_limit=None, retries=3):
+    """
+    Mount a keep-alive connection pool sized for workers concurrent requests,
+    with connection-level retries and adaptive rate limiting, on a requests
+    session.
+    """
+    limiter = AdaptiveLimiter(workers)
+    bucket = TokenBucket(rate_limit) if rate_limit else None
+    adapter = RateLimitedAdapter(
+        limiter,
+        bucket,
+        pool_connections=4,
+        pool_maxsize=max(10, workers),
+        # Throttled responses are retried by the adapter itself so the limiter sees them
+        max_retries=Retry(
+            total=retries, connect=retries, read=retries, status=0, backoff_factor=0.5,
+            respect_retry_after_header=False, raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return adapter
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
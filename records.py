@@ -0,0 +1,87 @@
+import sys
+
+class Record:
+    """
+    Compact, fixed-field stand-in for a dnacentersdk response dict. Only the
+    fields the agent reads are kept, in __slots__, with repeated string
+    values interned, so the SDK payload can be freed as soon as a page is
+    fetched. Supports the dict and attribute access the rest of the agent
+    already uses (record["id"], record.get("site"), record.family).
+    """
+    __slots__ = ()
+    # Fields with few distinct values across an inventory
+    INTERNED = ()
+
+    @classmethod
+    def from_sdk(cls, data):
+        record = cls()
+        for field in cls.__slots__:
+            value = data.get(field)
+            if field in cls.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(record, field, value)
+        return record
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def keys(self):
+        return [field for field in self.__slots__ if getattr(self, field, None) is not None]
+
+    def to_dict(self):
+        data = {}
+        for field in self.keys():
+            value = getattr(self, field)
+            if isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, Record) else item for item in value]
+            data[field] = value
+        return data
+
+    def __getstate__(self):
+        return tuple(getattr(self, field, None) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class InterfaceRecord(Record):
+    __slots__ = (
+        "id", "deviceId", "portName", "macAddress", "description", "speed", "status", "mtu",
+        "ipv4Address", "ipv4Mask",
+    )
+    INTERNED = ("speed", "status", "mtu", "ipv4Mask")
+
+
+class DeviceRecord(Record):
+    __slots__ = (
+        "id", "hostname", "family", "role", "platformId", "serialNumber", "softwareType", "softwareVersion",
+        "reachabilityStatus", "macAddress", "apEthernetMacAddress", "managementIpAddress", "lastUpdateTime",
+        # Attached while collecting
+        "site", "interfaces", "unchanged",
+    )
+    INTERNED = ("family", "role", "platformId", "softwareType", "softwareVersion", "reachabilityStatus", "site")
+
+    @classmethod
+    def from_sdk(cls, data):
+        record = super().from_sdk(data)
+        # Snapshots store interfaces inline
+        if record.interfaces is not None:
+            record.interfaces = [InterfaceRecord.from_sdk(interface) for interface in record.interfaces]
+        return record
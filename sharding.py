@@ -0,0 +1,26 @@
+import hashlib
+
+class Shard:
+    def __init__(self, index, count):
+        """
+        One of count agent nodes that each sync a disjoint slice of the
+        inventory. A device belongs to the shard its key hashes to, with
+        blake2b rather than hash() so every node agrees whatever its
+        PYTHONHASHSEED. Shard 0 is the designated shard for entities that
+        span devices of different shards (cables).
+        """
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Shard index must be between 0 and {count - 1}, got {index}")
+        self.index = index
+        self.count = count
+
+    @property
+    def designated(self):
+        return self.index == 0
+
+    def owns(self, key):
+        digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.count == self.index
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
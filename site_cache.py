@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+class SiteCache:
+    def __init__(self, path="./site_cache.db", ttl=None, max_entries=None, batch_size=100):
+        """
+        Persistent hostname prefix -> site cache backed by SQLite.
+
+        Entries older than ttl seconds are treated as misses, the cache is
+        trimmed to the max_entries most recently written entries, and new
+        entries are written in batches of batch_size inside one transaction.
+        Safe to share between fetch worker threads.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS site_cache (prefix TEXT PRIMARY KEY, site TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._entries = {
+            prefix: (site, updated)
+            for prefix, site, updated in self._conn.execute("SELECT prefix, site, updated FROM site_cache")
+        }
+        if not self._entries:
+            self._import_legacy_cache()
+        logging.debug(f"Loaded {len(self._entries)} site cache entries from {path}")
+
+    def _import_legacy_cache(self):
+        """
+        Seed an empty cache from the old site_cache.json next to it.
+        """
+        legacy_path = os.path.join(os.path.dirname(self.path) or ".", "site_cache.json")
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r") as file:
+                legacy = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Could not import legacy site cache {legacy_path}: {e}")
+            return
+        for prefix, site in legacy.items():
+            self.set(prefix, site)
+        self.flush()
+        logging.info(f"Imported {len(legacy)} entries from legacy site cache {legacy_path}")
+
+    def get(self, prefix):
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is None:
+                self.misses += 1
+                return None
+            site, updated = entry
+            if self.ttl and time.time() - updated > self.ttl:
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return site
+
+    def set(self, prefix, site):
+        with self._lock:
+            entry = (site, time.time())
+            self._entries[prefix] = entry
+            self._pending[prefix] = entry
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO site_cache (prefix, site, updated) VALUES (?, ?, ?)",
+                    [(prefix, site, updated) for prefix, (site, updated) in self._pending.items()],
+                )
+                if self.ttl:
+                    self._conn.execute("DELETE FROM site_cache WHERE updated < ?", (time.time() - self.ttl,))
+                if self.max_entries and len(self._entries) > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM site_cache WHERE prefix NOT IN "
+                        "(SELECT prefix FROM site_cache ORDER BY updated DESC LIMIT ?)",
+                        (self.max_entries,),
+                    )
+            logging.debug(f"Saved {len(self._pending)} site cache entries to {self.path}")
+            self._pending = {}
+            self._evict_locked()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to save site cache: {e}")
+
+    def _evict_locked(self):
+        now = time.time()
+        if self.ttl:
+            for prefix in [p for p, (_, updated) in self._entries.items() if now - updated > self.ttl]:
+                del self._entries[prefix]
+        if self.max_entries and len(self._entries) > self.max_entries:
+            oldest = sorted(self._entries, key=lambda p: self._entries[p][1])
+            for prefix in oldest[:len(self._entries) - self.max_entries]:
+                del self._entries[prefix]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def close(self):
+        self.flush()
+        logging.info(f"Site cache stats: {self.stats()}")
+        with self._lock:
+            self._conn.close()
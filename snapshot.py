@@ -0,0 +1,89 @@
+import os
+import gzip
+import json
+import time
+import threading
+from records import DeviceRecord
+
+SNAPSHOT_VERSION = 1
+
+class SnapshotWriter:
+    def __init__(self, path, agent_version=None):
+        """
+        Stream raw Catalyst Center responses to a gzip compressed NDJSON
+        snapshot: a header line, then one line per site and per collected
+        device (with its resolved site and raw interfaces). The snapshot is
+        written to a temporary file and only replaces path once the run
+        completes. Safe to write from several controllers' threads.
+        """
+        self.path = path
+        self.sites = 0
+        self.devices = 0
+        self._lock = threading.Lock()
+        self._temporary = f"{path}.tmp"
+        self._file = gzip.open(self._temporary, "wt", encoding="utf-8")
+        self._write("header", {"version": SNAPSHOT_VERSION, "agent_version": agent_version, "created": time.time()})
+
+    def _write(self, kind, data):
+        line = json.dumps({"type": kind, "data": data}, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line)
+            self._file.write("\n")
+
+    def write_sites(self, sites):
+        for site in sites:
+            self._write("site", site)
+        with self._lock:
+            self.sites += len(sites)
+
+    def write_device(self, device, row=None, interfaces=None):
+        """
+        Record a collected device. With its raw device list row (and raw
+        interface rows), those are written with the resolved site, so fields
+        the agent does not read yet are still in the snapshot.
+        """
+        data = device.to_dict() if isinstance(device, DeviceRecord) else device
+        if row is not None:
+            collected = data
+            data = dict(row)
+            for key in ("site", "unchanged"):
+                if key in collected:
+                    data[key] = collected[key]
+            if "interfaces" in collected:
+                data["interfaces"] = list(interfaces) if interfaces is not None else collected["interfaces"]
+        self._write("device", data)
+        with self._lock:
+            self.devices += 1
+
+    def close(self, commit=True):
+        self._file.close()
+        if commit:
+            os.replace(self._temporary, self.path)
+        else:
+            os.remove(self._temporary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close(commit=exc_type is None)
+
+
+def read_snapshot(path, logging):
+    """
+    Yield the devices of a snapshot one line at a time, as the same
+    DeviceRecords a live sync produces, so replay memory does not grow
+    with the inventory.
+    """
+    devices = 0
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            record = json.loads(line)
+            if record["type"] == "header":
+                if record["data"].get("version") != SNAPSHOT_VERSION:
+                    raise ValueError(f"Unsupported snapshot version {record['data'].get('version')} in {path}")
+                logging.info(f"Replaying snapshot {path} recorded by agent version {record['data'].get('agent_version')}")
+            elif record["type"] == "device":
+                devices += 1
+                yield DeviceRecord.from_sdk(record["data"])
+    logging.info(f"Replayed {devices} devices from {path}")
@@ -0,0 +1,114 @@
+import hashlib
+import sqlite3
+import logging
+import threading
+
+class SyncState:
+    def __init__(self, path="./sync_state.db", full=False):
+        """
+        Local state for incremental syncs: the lastUpdateTime Catalyst Center
+        reported for each device and a fingerprint of every entity sent to
+        Diode. With full=True nothing is treated as unchanged, but the state
+        is still rewritten so the next incremental run starts from it.
+        """
+        self.path = path
+        self.full = full
+        self.skipped_devices = 0
+        self.skipped_entities = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS devices (id TEXT PRIMARY KEY, last_update TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints (key TEXT PRIMARY KEY, digest TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._devices = dict(self._conn.execute("SELECT id, last_update FROM devices"))
+        self._fingerprints = dict(self._conn.execute("SELECT key, digest FROM fingerprints"))
+        logging.info(
+            f"Loaded sync state for {len(self._devices)} devices and {len(self._fingerprints)} entities from {path}"
+        )
+
+    def device_unchanged(self, device_id, last_update):
+        """
+        True when the device reports the same lastUpdateTime as the last
+        successfully ingested sync.
+        """
+        if self.full or not device_id or last_update is None:
+            return False
+        with self._lock:
+            unchanged = self._devices.get(device_id) == str(last_update)
+            if unchanged:
+                self.skipped_devices += 1
+            return unchanged
+
+    def new_batch(self):
+        return {"devices": {}, "fingerprints": {}}
+
+    def stage_device(self, device_id, last_update, batch):
+        if device_id and last_update is not None:
+            batch["devices"][device_id] = str(last_update)
+
+    def filter_changed(self, entities, batch):
+        """
+        Return only the entities whose fingerprint differs from the stored
+        one, staging the new fingerprints in batch.
+        """
+        changed = []
+        with self._lock:
+            for entity in entities:
+                key = entity_key(entity)
+                digest = hashlib.blake2b(entity.SerializeToString(deterministic=True), digest_size=16).hexdigest()
+                if not self.full and self._fingerprints.get(key) == digest:
+                    self.skipped_entities += 1
+                    continue
+                batch["fingerprints"][key] = digest
+                changed.append(entity)
+        return changed
+
+    def commit(self, batch):
+        """
+        Persist a batch once Diode has accepted it.
+        """
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO devices (id, last_update) VALUES (?, ?)",
+                        batch["devices"].items(),
+                    )
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO fingerprints (key, digest) VALUES (?, ?)",
+                        batch["fingerprints"].items(),
+                    )
+            except sqlite3.Error as e:
+                logging.error(f"Failed to save sync state: {e}")
+                return
+            self._devices.update(batch["devices"])
+            self._fingerprints.update(batch["fingerprints"])
+
+    def close(self):
+        logging.info(
+            f"Incremental sync skipped {self.skipped_devices} unchanged devices and {self.skipped_entities} unchanged entities"
+        )
+        with self._lock:
+            self._conn.close()
+
+
+def entity_key(entity):
+    """
+    Identity of an entity across runs, independent of its other attributes.
+    """
+    kind = entity.WhichOneof("entity")
+    if kind == "device":
+        return f"device:{entity.device.name}"
+    if kind == "interface":
+        return f"interface:{entity.interface.device.name}:{entity.interface.name}"
+    if kind == "ip_address":
+        ip = entity.ip_address
+        return f"ip_address:{ip.address}:{ip.interface.device.name}:{ip.interface.name}"
+    if kind == "prefix":
+        return f"prefix:{entity.prefix.prefix}:{entity.prefix.site.name}"
+    return f"{kind}:{hashlib.blake2b(entity.SerializeToString(deterministic=True), digest_size=16).hexdigest()}"
@@ -0,0 +1,120 @@
+from netboxlabs.diode.sdk.ingester import Device, Interface, Entity
+from metrics import METRICS
+
+try:
+    # Cables need a Diode SDK with DCIM cable support
+    from netboxlabs.diode.sdk.ingester import Cable, GenericObject
+except ImportError:
+    Cable = None
+    GenericObject = None
+
+CABLES_SUPPORTED = Cable is not None
+
+class PortIndex:
+    def __init__(self):
+        """
+        Hash index from (device id, port name) to the Diode device the port
+        was sent on, filled while devices are transformed so topology links
+        are joined with one lookup per end. Devices whose interfaces were not
+        collected this run (unchanged or skipped) are kept by id only and
+        trusted for any port name.
+        """
+        self.ports = {}
+        self.uncollected = {}
+
+    def add_device(self, device_id, device_name, site_name, port_names=None):
+        # One tuple per device, shared by all of its ports
+        device_ref = (device_name, site_name)
+        if port_names is None:
+            self.uncollected[device_id] = device_ref
+            return
+        for port_name in port_names:
+            self.ports[(device_id, port_name)] = device_ref
+
+    def resolve(self, device_id, port_name):
+        """
+        Return (device name, site name) for a link end, or None when the
+        port is not one we sent.
+        """
+        device_ref = self.ports.get((device_id, port_name))
+        if device_ref is None:
+            device_ref = self.uncollected.get(device_id)
+        return device_ref
+
+    def __len__(self):
+        return len(self.ports) + len(self.uncollected)
+
+
+def _termination(device_ref, port_name):
+    device_name, site_name = device_ref
+    return GenericObject(object_interface=Interface(name=port_name, device=Device(name=device_name, site=site_name)))
+
+
+def build_cable_entities(links, port_index, logging, tags=None):
+    """
+    Yield a Cable entity per physical link whose two ends are both known
+    to port_index. Links reported once from each end are emitted once.
+    """
+    seen = set()
+    unresolved = 0
+    for link in links:
+        a_end = (link.get("source"), link.get("startPortName"))
+        b_end = (link.get("target"), link.get("endPortName"))
+        key = frozenset((a_end, b_end))
+        if key in seen:
+            continue
+        seen.add(key)
+        a_ref = port_index.resolve(*a_end)
+        b_ref = port_index.resolve(*b_end)
+        if a_ref is None or b_ref is None or not a_end[1] or not b_end[1]:
+            unresolved += 1
+            continue
+        yield Entity(cable=Cable(
+            a_terminations=[_termination(a_ref, a_end[1])],
+            b_terminations=[_termination(b_ref, b_end[1])],
+            status="connected",
+            tags=tags,
+        ))
+    METRICS.set_gauge("topology_links_unresolved", unresolved)
+    logging.info(f"Built cables for {len(seen) - unresolved} of {len(seen)} links, {unresolved} with an end outside the inventory")
+
+
+def sync_cables(catc, client, port_index, logging, sync_state=None, tags=None):
+    """
+    Fetch the physical topology in one bulk request and queue Cable
+    entities on client, an IngestPipeline, in the same byte-sized batches
+    as prepare_data.
+    """
+    if not CABLES_SUPPORTED:
+        logging.warning("The installed Diode SDK has no Cable entity, skipping topology")
+        return
+
+    with METRICS.stage("topology_fetch"):
+        response = catc.topology.get_physical_topology()
+    links = (response.get("response") or {}).get("links") or []
+    logging.info(f"Retrieved {len(links)} topology links, joining them against {len(port_index)} indexed ports")
+
+    entities = []
+    entities_bytes = 0
+
+    def _ingest(entities):
+        batch = sync_state.new_batch() if sync_state is not None else None
+        if batch is not None:
+            entities = sync_state.filter_changed(entities, batch)
+        on_success = (lambda: sync_state.commit(batch)) if batch is not None else None
+        METRICS.inc("entities_total", {"type": "cable"}, len(entities))
+        if entities:
+            client.submit(entities, on_success)
+        elif on_success is not None:
+            on_success()
+
+    with METRICS.stage("topology_build"):
+        for entity in build_cable_entities(links, port_index, logging, tags):
+            entities.append(entity)
+            entities_bytes += entity.ByteSize()
+            if entities_bytes >= client.batch_bytes:
+                _ingest(entities)
+                entities = []
+                entities_bytes = 0
+        if entities:
+            _ingest(entities)
@@ -1,15 +1,64 @@
 import re
 import yaml
+import socket
 import logging
 import ipaddress
+from functools import lru_cache
+
+DEVICE_TYPE_REPLACEMENTS = [
+    (re.compile(r"^C"), "Catalyst "),
+    (re.compile(r"^WS\-C"), "Catalyst "),
+    (re.compile(r"^IE\-"), "Catalyst IE"),
+    (re.compile(r"^AIR\-AP"), "Catalyst "),
+    (re.compile(r"^AIR\-CAP"), "Catalyst "),
+    (re.compile(r"\-K9$"), ""),
+    (re.compile(r"^([^\,]+)\,.+"), r"\1"),
+]
+
+# Mapping of speeds to physical interface types
+SPEED_TO_TYPE = {
+    100: "100base-t",
+    1000: "1000base-t",
+    10000: "10gbase-x-sfpp",
+    25000: "25gbase-x-sfp28",
+    40000: "40gbase-x-qsfpp",
+    100000: "100gbase-x-qsfp28",
+}
+
+# Dotted netmask to (prefix length, mask as an integer), for every valid mask
+MASK_TABLE = {
+    socket.inet_ntoa(((0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF).to_bytes(4, "big")):
+        (length, (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF)
+    for length in range(33)
+}
+
+# Characters of the slot/port numbering that follows a port name prefix
+PORT_NUMBERING = "0123456789/.:"
 
 class Transformer:
-    def __init__(self, site_rules_path, skip_rules_path):
+    def __init__(self, site_rules_path, skip_rules_path, cache_size=4096):
         """
         Initialize the Transformer with paths to regex rules for site and tenant mappings.
+        Rules are compiled once here and rule lookups are memoized per input
+        value, so one instance should be shared for a whole run.
         """
+        self.site_rules_path = site_rules_path
+        self.skip_rules_path = skip_rules_path
+        self.cache_size = cache_size
         self.site_rules = self._load_rules(site_rules_path)
         self.skip_device_rules = self._load_rules(skip_rules_path)
+        self._site_rules = self._compile_rules(self.site_rules)
+        self._skip_device_rules = self._compile_patterns(self.skip_device_rules)
+
+        self.should_skip_device = lru_cache(maxsize=cache_size)(self.should_skip_device)
+        self.site_to_site = lru_cache(maxsize=cache_size)(self.site_to_site)
+        self.transform_device_type = lru_cache(maxsize=cache_size)(self.transform_device_type)
+        self._port_kind = lru_cache(maxsize=cache_size)(self._port_kind)
+
+    def __reduce__(self):
+        # The memoized methods cannot be pickled, so worker processes
+        # rebuild the transformer from the same rule files
+        return (Transformer, (self.site_rules_path, self.skip_rules_path, self.cache_size))
 
     def _load_rules(self, path):
         try:
@@ -18,11 +67,34 @@ class Transformer:
         except Exception as e:
             logging.error(f"Failed to load rules from {path}: {e}")
             exit(1)
+
+    def _compile_patterns(self, patterns):
+        compiled = []
+        for pattern in patterns or []:
+            try:
+                compiled.append(re.compile(pattern, flags=re.IGNORECASE))
+            except re.error as e:
+                logging.error(f"Regex error in rule {pattern}: {e}")
+        return compiled
+
+    def _compile_rules(self, rules):
+        compiled = []
+        for rule in rules or []:
+            # Validate rule structure
+            if len(rule) != 2:
+                logging.error(f"Malformed rule: {rule}")
+                continue
+            pattern, replacement = rule
+            try:
+                compiled.append((re.compile(pattern, flags=re.IGNORECASE), replacement))
+            except re.error as e:
+                logging.error(f"Regex error in rule {rule}: {e}")
+        return compiled
     
     def should_skip_device(self, name):
-        for pattern in self.skip_device_rules:
-            if re.match(pattern, name, flags=re.IGNORECASE):
-                logging.debug(f"Skipping Device: {name} (matched pattern: {pattern})")
+        for pattern in self._skip_device_rules:
+            if pattern.match(name):
+                logging.debug(f"Skipping Device: {name} (matched pattern: {pattern.pattern})")
                 return True
         return False       
     
@@ -31,41 +103,43 @@ class Transformer:
             return None
         return hostname.lower().split(".clemson.edu")[0]
 
-    def apply_regex_replacements(self, value, rules):
-        try:
-            for rule in rules:
-                # Validate rule structure
-                if len(rule) != 2:
-                    logging.error(f"Malformed rule: {rule}")
-                    continue
-
-                pattern, replacement = rule
-                if re.match(pattern, value, flags=re.IGNORECASE):
-                    return re.sub(pattern, replacement, value, flags=re.IGNORECASE)
-        except re.error as e:
-            # Handle regex errors gracefully
-            logging.error(f"Regex error {value} {rule}: {e}")
-            return value
-
+    def apply_compiled_replacements(self, value, rules):
+        """
+        Replace value with the first rule, compiled by _compile_rules, that
+        matches it.
+        """
+        for pattern, replacement in rules:
+            if pattern.match(value):
+                try:
+                    return pattern.sub(replacement, value)
+                except re.error as e:
+                    # Handle bad replacement templates gracefully
+                    logging.error(f"Regex error {value} {(pattern.pattern, replacement)}: {e}")
+                    return value
         return value
 
-    def regex_replace(self, value, pattern, replacement):
-        try:
-            return re.sub(pattern, replacement, value)
-        except re.error as e:
-            # Handle regex errors gracefully
-            logging.error(f"Regex error {value} {pattern}: {e}")
-            return "Unknown"
-
     def get_cidr(self, ip, mask):
+        known = MASK_TABLE.get(mask)
+        if known is not None:
+            return f"{ip}/{known[0]}"
         try:
             prefix_length = ipaddress.IPv4Network(f"0.0.0.0/{mask}").prefixlen
             return f"{ip}/{prefix_length}"
-        except ValueError:
+        except ValueError as e:
             logging.error(f"CIDR error {ip} {mask}: {e}")
             return None
 
     def get_network_addr(self, ip, prefix_or_mask):
+        known = MASK_TABLE.get(prefix_or_mask)
+        if known is not None and "." in ip:
+            # Mask the address as an integer instead of building an IPv4Network.
+            # IPv4Address is as strict as IPv4Network (no leading zeros or
+            # short forms), unlike inet_aton
+            try:
+                address = int(ipaddress.IPv4Address(ip))
+                return f"{socket.inet_ntoa((address & known[1]).to_bytes(4, 'big'))}/{known[0]}"
+            except ValueError:
+                pass
         try:
             if "." in ip:  # IPv4
                 network = ipaddress.IPv4Network(f"{ip}/{prefix_or_mask}", strict=False)
@@ -82,7 +156,7 @@ class Transformer:
         """
         Apply site_rules        
         """
-        return self.apply_regex_replacements(name, self.site_rules)
+        return self.apply_compiled_replacements(name, self._site_rules)
 
     def map_duplex(self,duplex):
         """
@@ -97,30 +171,32 @@ class Transformer:
 
     def infer_interface_type(self, port_name, speed):
         """
-        Infer interface type based on portName and speed.
-        """
-        # Mapping of speeds to physical interface types
-        speed_to_type_map = {
-            100: "100base-t",
-            1000: "1000base-t",
-            10000: "10gbase-x-sfpp",
-            25000: "25gbase-x-sfp28",
-            40000: "40gbase-x-qsfpp",
-            100000: "100gbase-x-qsfp28",
-        }
+        Infer interface type based on portName and speed. The kind of port
+        is looked up by the name with its slot/port numbering stripped, so
+        the substring checks run once per prefix rather than per interface.
+        """
         try:
-            # Check if the portName indicates an ethernet interface
-            if "E" in port_name:
+            kind = self._port_kind(port_name.rstrip(PORT_NUMBERING))
+            if kind == "ethernet":
                 # Map speed to physical interface type
-                return speed_to_type_map.get(speed)
-            elif "channel" in port_name:
-                return "lag"
-            else:
-                return "virtual"
+                return SPEED_TO_TYPE.get(speed)
+            return kind
         except Exception as e:
             logging.error(f"Infer interface type error {port_name} {speed}: {e}")
             return None
 
+    def _port_kind(self, prefix):
+        """
+        Kind of port ("ethernet", "lag" or "virtual") of a port name prefix
+        such as "GigabitEthernet" or "Vlan".
+        """
+        # Check if the portName indicates an ethernet interface
+        if "E" in prefix:
+            return "ethernet"
+        elif "channel" in prefix:
+            return "lag"
+        return "virtual"
+
     def transform_device_type(self, platform_id):
         """
         Transforms platformId to device type with replacements for Cisco Catalyst models.
@@ -128,17 +204,8 @@ class Transformer:
         if not platform_id:
             return None
         device_type = platform_id
-        replacements = [
-            (r"^C", "Catalyst "),
-            (r"^WS\-C", "Catalyst "),
-            (r"^IE\-", "Catalyst IE"),
-            (r"^AIR\-AP", "Catalyst "),
-            (r"^AIR\-CAP", "Catalyst "),
-            (r"\-K9$", ""),
-            (r"^([^\,]+)\,.+", r"\1"),
-        ]
-        for pattern, replacement in replacements:
-            device_type = self.regex_replace(device_type, pattern, replacement)
+        for pattern, replacement in DEVICE_TYPE_REPLACEMENTS:
+            device_type = pattern.sub(replacement, device_type)
         return {"model": device_type, "manufacturer": {"name": "Cisco"}}
 
 